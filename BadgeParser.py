@@ -0,0 +1,61 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: BadgeParser.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 7/8/23 11:21
+"""
+import re
+from functools import lru_cache
+
+# badge titles of a first month member, e.g. "New member"
+NEW_MEMBER_PATTERN = re.compile(r'^\s*(new member|nuevo miembro|novo membro|nouveau membre|neues mitglied|'
+                                r'nuovo membro|新規メンバー|新会员|新會員|신규 회원|anggota baru)\s*$', re.IGNORECASE)
+# any badge title of a member, e.g. "Member (6 months)"
+MEMBER_PATTERN = re.compile(r'ember|miembro|membro|membre|mitglied|メンバー|会员|會員|회원|anggota', re.IGNORECASE)
+# number and unit of the membership period, e.g. "1 year", "6 meses", "2 か月".
+# the unit must not run into more letters, e.g. "an" in "1 anniversary" is not a year
+PERIOD_PATTERN = re.compile(r'(\d+)\s*(months?|meses|mes|mois|monate|monat|mesi|mese|か月|ヶ月|个月|個月|개월|bulan|'
+                            r'years?|años|año|anos|ano|ans|an|jahre|jahr|anni|anno|年|년|tahun)(?![a-zà-ÿ])',
+                            re.IGNORECASE)
+UNIT_MONTHS = {'month': 1, 'months': 1, 'meses': 1, 'mes': 1, 'mois': 1, 'monate': 1, 'monat': 1, 'mesi': 1,
+               'mese': 1, 'か月': 1, 'ヶ月': 1, '个月': 1, '個月': 1, '개월': 1, 'bulan': 1,
+               'year': 12, 'years': 12, 'años': 12, 'año': 12, 'anos': 12, 'ano': 12, 'ans': 12, 'an': 12,
+               'jahre': 12, 'jahr': 12, 'anni': 12, 'anno': 12, '年': 12, '년': 12, 'tahun': 12}
+
+unparsed_titles = set()
+
+
+@lru_cache(maxsize=None)
+def parse_badge_title(title):
+    """
+    get the membership period from the title of a badge, results are cached since there are only a few titles
+    :param title: badge title, e.g. "Member (1 year)"
+    :return: number of months, None if the badge is not a membership badge or the period cannot be parsed
+    """
+    if NEW_MEMBER_PATTERN.match(title):
+        return 1  # default new member to 1 month
+    if not MEMBER_PATTERN.search(title):
+        return None  # e.g. Moderator, Verified
+    periods = PERIOD_PATTERN.findall(title)
+    if not periods:
+        if title not in unparsed_titles:
+            unparsed_titles.add(title)
+            print(f'[badge] cannot parse membership period of "{title}"')
+        return None
+    # e.g. "Member (1 year, 2 months)"
+    return sum(int(number) * UNIT_MONTHS[unit.lower()] for number, unit in periods)
+
+
+def get_member_period(message):
+    """
+    get the membership period of the author of a message
+    :param message: message dict from ChatDownloader
+    :return: number of months, None if the author is not a member
+    """
+    for badge in message['author'].get('badges', ()):
+        months = parse_badge_title(badge['title'])
+        if months is not None:
+            return months
+    return None
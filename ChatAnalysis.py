@@ -6,24 +6,73 @@
 @email: rxy216@case.edu
 @time: 4/23/23 17:48
 """
-import json
+import itertools
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud
 
+from ChatArchive import ChatArchive, SUFFIX as ARCHIVE_SUFFIX
+from CurrencyConverter import CurrencyConverter, normalize_currency
 from CurrencyExchange import CurrencyExchange
+from IncomeCube import IncomeCube
+from MembershipDistribution import MembershipDistribution
+from Metrics import metrics
+from PaidChatColumns import get_file_signature, summarize_paid_chat
+from StreamingChat import MAX_WORDS, summarize_paid_chat_stream
+from WordFrequency import WordCountCache, WordFrequency
+
+
+def summarize_video(file_name, count_words, streaming):
+    """
+    summarize the paid messages of a video, runs in the worker processes of ChatAnalysis
+    :param file_name: path of the chat file
+    :param count_words: count the words of the messages
+    :param streaming: read the file one message at a time, see StreamingChat
+    :return: dict returned by summarize_paid_chat, with the metrics recorded in a worker process, see Metrics.merge
+    """
+    with metrics.profile_worker('analysis.load'), metrics.worker_task() as worker_metrics:
+        if streaming:
+            summary = summarize_paid_chat_stream(file_name, count_words)
+        else:
+            summary = summarize_paid_chat(file_name, count_words)
+    summary['metrics'] = worker_metrics.data
+    return summary
 
 
 class ChatAnalysis:
     MEMBERSHIP_PRICE = 4.99
+    WORD_CACHE = 'cached_word_freq.json'
+    TIME_SERIES_CACHE = 'cached_time_series.json'
 
-    def __init__(self, chat_path='chats/', membership_file='membership/member_list.json'):
+    def __init__(self, chat_path='chats/', membership_file='membership/member_list.json', rate_source=None,
+                 workers=1, talent=None, currency_exchange=None, streaming=False, words=True):
         """
         initialize the chat analysis class
         :param chat_path: path to the chat folder where all the chat files are stored
         :param membership_file: path to the membership file
+        :param rate_source: source of exchange rates, see RateTable, exchangerate.host by default
+        :param workers: number of processes that parse the chat files, 1 means parse in this process
+        :param talent: Talent to analysis, its files are used instead of chat_path and membership_file
+        :param currency_exchange: CurrencyExchange shared with other analyses, a new one from rate_source if None
+        :param streaming: read the .json chat files one message at a time and keep at most MAX_WORDS words,
+            for archives that do not fit in memory, the totals are the same. the word counts of the videos are
+            read one video at a time, so memory is bounded by the largest video and MAX_WORDS
+        :param words: count the words for the word cloud, without them a totals query needs no chat file that is
+            already in the income cube and does not load wordcloud
         """
+        word_cache = self.WORD_CACHE
+        income_cube = IncomeCube.CUBE_FILE
+        time_series = self.TIME_SERIES_CACHE
+        if talent is not None:
+            chat_path = talent.chat_path
+            membership_file = talent.member_list
+            word_cache = talent.word_cache
+            income_cube = talent.income_cube
+            time_series = talent.time_series
+        self.workers = workers
+        self.streaming = streaming
+        self.words = words
         self.all_prints = []
         self.total_membership_revenue = None
         self.temp_video_list_seq_count = {}
@@ -34,15 +83,29 @@ class ChatAnalysis:
         self.income_by_month = {}
         self.membership = None
         self.chat_path = chat_path
-        self.currency_exchange = CurrencyExchange()
+        self.currency_exchange = currency_exchange if currency_exchange is not None else CurrencyExchange(rate_source)
+        self.currency_converter = CurrencyConverter(self.currency_exchange)
+        self.word_cache = WordCountCache(word_cache)
+        self.income_cube = IncomeCube(income_cube)
+        self.time_series_cache = time_series
+        self.time_series = None
         file_list = os.listdir(chat_path)
         self.video_list = []
         for video in file_list:
-            if 'json' in video:
+            # use the columnar .npz file of a video if it has been converted
+            if video.endswith('.npz') or (video.endswith('.json') and video[:-len('.json')] + '.npz' not in file_list):
+                self.video_list.append(video)
+        # videos moved into the compressed archive of the folder, a loose file of the same video is newer
+        loose = {video.rsplit('.', 1)[0] for video in self.video_list}
+        for video in ChatArchive(chat_path).get_videos():
+            if video[:-len(ARCHIVE_SUFFIX)] not in loose:
                 self.video_list.append(video)
+        # the video sequence ids depend on the processing order, keep it the same on every run
+        self.video_list.sort()
         self.load_membership(membership_file)
         print(f'Total number of videos: {len(self.video_list)}')
-        self.load_paid_message()
+        with metrics.stage('analysis.load'):
+            self.load_paid_message()
 
     def get_video_sequence_id(self, video_date):
         """
@@ -58,20 +121,15 @@ class ChatAnalysis:
             self.temp_video_list_seq_count[year_month] += 1
             return year_month + str(self.temp_video_list_seq_count[year_month])
 
-    def get_amount_in_usd(self, amount, currency):
+    def get_amount_in_usd(self, amount, currency, day):
         """
-        convert the amount to usd
+        convert the amount to usd with the exchange rate of the day the money was paid
         :param amount: amount of money
         :param currency: currency symbol
+        :param day: YYYY-MM-DD
         :return: amount in usd
         """
-        if currency == '₫':
-            currency = 'VND'
-        currency = currency.upper()
-        if currency == 'USD':
-            return amount
-        else:
-            return amount * self.currency_exchange.get_exchange_rate(currency, 'USD')
+        return self.currency_converter.to_usd(amount, currency, day)
 
     def set_income_usd_by_currency(self, currency, usd_amount):
         """
@@ -98,48 +156,149 @@ class ChatAnalysis:
             self.income_by_month[month] = usd_amount
 
     def load_membership(self, membership_file):
-        with open(membership_file, 'r') as f:
-            membership = json.load(f)
-        self.membership = np.array([])
-        for member in membership:
-            self.membership = np.append(self.membership, membership[member])
+        """
+        load the membership period of every member
+        :param membership_file: path to the membership file
+        :return:
+        """
+        self.membership = MembershipDistribution.from_file(membership_file)
 
     def load_paid_message(self):
         """
         load all the paid message from the chat file
-        self.all_chat_data is a dictionary with key as date-No.xxx and value as a chat data dictionary
+        only the chat files that are new or changed are parsed, the others are read from the income cube
         :return:
         """
         self.income_by_video = {}
         self.total_income_in_usd = 0
-        self.word_cloud_data = ""
+        if self.words:
+            self.word_cloud_data = WordFrequency(max_words=MAX_WORDS if self.streaming else None)
         processed_video_count = 0
+        file_names = [self.chat_path + video for video in self.video_list]
+        signatures = [get_file_signature(file_name) for file_name in file_names]
+        # only count words of the videos that are new or changed since the counts were cached
+        count_words = [self.words and not self.word_cache.is_up_to_date(video, signature)
+                       for video, signature in zip(self.video_list, signatures)]
+        todo = [i for i, video in enumerate(self.video_list)
+                if count_words[i] or not self.income_cube.is_up_to_date(video, signatures[i])]
+        metrics.count('analysis.videos.parsed', len(todo))
+        if self.workers > 1 and len(todo) > 1:
+            # parse the files in worker processes, results come in the order of the video list
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                if self.streaming:
+                    summaries = self.iter_summaries_bounded(executor, [file_names[i] for i in todo],
+                                                            [count_words[i] for i in todo])
+                else:
+                    summaries = executor.map(summarize_video, [file_names[i] for i in todo],
+                                             [count_words[i] for i in todo], [False] * len(todo), chunksize=8)
+                for i, summary in zip(todo, summaries):
+                    self.update_video_summary(self.video_list[i], signatures[i], summary)
+                    processed_video_count += 1
+                    print('\r', 'Processing: ', processed_video_count, '/', len(todo), end='')
+        else:
+            for i in todo:
+                self.update_video_summary(self.video_list[i], signatures[i],
+                                          summarize_video(file_names[i], count_words[i], self.streaming))
+                processed_video_count += 1
+                print('\r', 'Processing: ', processed_video_count, '/', len(todo), end='')
+        self.word_cache.flush()
+        self.income_cube.flush()
+        self.income_cube.remove_other_videos(self.video_list)
         for video in self.video_list:
-            with open(self.chat_path + video, 'r') as f:
-                chat_data = json.load(f)
-            vid_seq = self.get_video_sequence_id(chat_data['metadata']['publish_date'])
-            del chat_data['metadata']
-            video_total_income = 0
-            for msg_data in chat_data.items():
-                msg_data = msg_data[1]
-                # store data for word cloud
-                if msg_data['msg'] is not None:
-                    self.word_cloud_data += msg_data['msg']
-                # convert the amount to usd
-                usd_amount = self.get_amount_in_usd(msg_data['money']['amount'], msg_data['money']['currency'])
-                # store data for total income
-                self.total_income_in_usd += usd_amount
-                # store data for income by currency
-                self.set_income_usd_by_currency(msg_data['money']['currency'], usd_amount)
-                # store data for income by video
-                video_total_income += usd_amount
-            self.income_by_video[vid_seq] = video_total_income
-            self.set_income_by_month(vid_seq[:6], video_total_income)
-            processed_video_count += 1
-            print('\r', 'Processing: ', processed_video_count, '/', len(self.video_list), end='')
-            # print(f'No.{processed_video_count} Video {video} total income: {video_total_income} USD')
+            self.merge_video(video)
         print('')
 
+    def iter_summaries_bounded(self, executor, file_names, count_words):
+        """
+        summarize the videos in streaming mode with at most two videos per worker submitted at a time,
+        executor.map submits all of them at once and the finished summaries wait in memory for the slow ones
+        :param executor: ProcessPoolExecutor
+        :param file_names: paths of the chat files
+        :param count_words: count the words of the messages, one per file
+        :return: generator of the summaries in the order of file_names
+        """
+        window = deque()
+        jobs = iter(zip(file_names, count_words))
+        for file_name, count in itertools.islice(jobs, 2 * self.workers):
+            window.append(executor.submit(summarize_video, file_name, count, True))
+        while window:
+            summary = window.popleft().result()
+            for file_name, count in itertools.islice(jobs, 1):
+                window.append(executor.submit(summarize_video, file_name, count, True))
+            yield summary
+
+    def update_video_summary(self, video, signature, summary):
+        """
+        store the pre-aggregated paid messages of a new or changed video in the income cube and the word cache
+        :param video: file name of the video
+        :param signature: signature of the file, see get_file_signature
+        :param summary: dict returned by summarize_paid_chat
+        :return:
+        """
+        metrics.merge(summary['metrics'])
+        if summary['words'] is not None:
+            self.word_cache.set_counts(video, signature, summary['words'])
+        # convert the amounts of the whole video to usd at once
+        codes = [normalize_currency(currency) for currency in summary['currencies']]
+        cell_amounts = [cell[3] for cell in summary['cells']]
+        cell_codes = [codes[cell[0]] for cell in summary['cells']]
+        usd_amounts = self.currency_converter.to_usd_array(cell_amounts, cell_codes, summary['publish_date'])
+        self.income_cube.set_video(video, signature, summary, codes, usd_amounts)
+
+    def merge_video(self, video):
+        """
+        add the income and the words of a video to the totals
+        :param video: file name of the video
+        :return:
+        """
+        entry = self.income_cube.get_video(video)
+        vid_seq = self.get_video_sequence_id(entry['publish_date'])
+        # store data for word cloud
+        if self.words:
+            self.word_cloud_data.merge(self.word_cache.get_counts(video))
+        video_total_income = 0
+        for code, bucket, messages, amount, usd_amount in entry['cells']:
+            video_total_income += usd_amount
+            # store data for income by currency
+            self.set_income_usd_by_currency(code, usd_amount)
+        # store data for total income
+        self.total_income_in_usd += video_total_income
+        # store data for income by video
+        self.income_by_video[vid_seq] = video_total_income
+        self.set_income_by_month(entry['month'], video_total_income)
+
+    def query_income(self, by=('month',), value='usd'):
+        """
+        sum the paid messages of the analysed videos grouped by some dimensions, served from the income cube
+        :param by: names of the dimensions, see IncomeCube.DIMENSIONS
+        :param value: 'usd', 'amount' or 'messages'
+        :return: {key: sum}
+        """
+        return self.income_cube.query(by, self.video_list, value)
+
+    def get_time_series(self, bin_seconds=60):
+        """
+        income of every stream in fixed time windows, only new or changed chat files are parsed
+        :param bin_seconds: width of a window in seconds
+        :return: StreamTimeSeries
+        """
+        if self.time_series is None or self.time_series.bin_seconds != bin_seconds:
+            from StreamTimeSeries import StreamTimeSeries
+            self.time_series = StreamTimeSeries(self.chat_path, self.video_list, self.currency_converter,
+                                                self.time_series_cache, bin_seconds, self.workers, self.streaming)
+        return self.time_series
+
+    def get_income_over_stream(self, points=100):
+        """
+        average share of the income of a stream earned until every fraction of its duration
+        :param points: number of points on the time axis
+        :return: {"progress": fractions of the duration, "share": average share of the income}
+        """
+        videos, matrix = self.get_time_series().get_stacked_matrix(normalize=True, points=points)
+        earning = matrix[:, -1] > 0  # streams without paid messages have no curve
+        share = matrix[earning].mean(axis=0) if earning.any() else np.zeros(points)
+        return {'progress': np.linspace(0, 1, points).tolist(), 'share': share.tolist()}
+
     def analysis_all(self):
         """
         analysis and plot all the data
@@ -151,10 +310,55 @@ class ChatAnalysis:
         print('Membership plots:')
         self.analysis_membership()
         self.all_prints.append(' ')
-        self.all_prints.append(f'Total income on Youtube: {round(self.total_income_in_usd + self.total_membership_revenue, 2)} USD')
+        self.all_prints.append(self.get_total_income_print())
         for print_data in self.all_prints:
             print(print_data)
 
+    def get_total_income_print(self):
+        """
+        :return: the line of the total income of paid messages and membership
+        """
+        return f'Total income on Youtube: {round(self.total_income_in_usd + self.total_membership_revenue, 2)} USD'
+
+    def summarize_all(self):
+        """
+        fill all_prints in the same order as analysis_all, without plotting
+        :return: all_prints
+        """
+        self.all_prints = [' ', f'Total paid message revenue: {round(self.total_income_in_usd, 2)} USD']
+        self.summarize_membership()
+        self.all_prints.append(' ')
+        self.all_prints.append(self.get_total_income_print())
+        return self.all_prints
+
+    def get_figure_data(self):
+        """
+        input data of every figure, see Plots.FIGURES
+        :return: {figure name: json serializable data}
+        """
+        return {
+            'income_by_currency': self.income_usd_by_currency,
+            'income_by_month': self.income_by_month,
+            'income_by_video': self.income_by_video,
+            'word_cloud': dict(self.word_cloud_data.get_counts()),
+            'membership_distribution': {'lengths': self.membership.lengths.tolist(),
+                                        'counts': self.membership.counts.tolist()},
+            'income_over_stream': self.get_income_over_stream(),
+        }
+
+    def write_report(self, output_path='report/', formats=('png', 'svg'), workers=2, title='Youtube income report'):
+        """
+        render all figures off-screen and write a markdown and html summary, instead of showing windows
+        :param output_path: folder of the report
+        :param formats: file formats of the figures
+        :param workers: number of processes that draw the figures
+        :param title: title of the report
+        :return: paths of the markdown and the html file
+        """
+        from ReportRenderer import ReportRenderer
+        renderer = ReportRenderer(output_path, formats, workers)
+        return renderer.render(title, self.summarize_all(), self.get_figure_data())
+
     def analysis_paid_message(self):
         """
         analysis and plot the paid message data
@@ -169,89 +373,85 @@ class ChatAnalysis:
         self.plot_income_by_video()
         print('Key word cloud from all paid messages:')
         self.plot_word_cloud()
+        print('Income over the stream:')
+        self.plot_income_over_stream()
+
+    @staticmethod
+    def show_figure(name, data):
+        """
+        draw a figure and show it in a window, matplotlib is only loaded here
+        :param name: name of the figure in Plots.FIGURES
+        :param data: input data of the plot function
+        """
+        import matplotlib.pyplot as plt
+        from Plots import FIGURES
+        FIGURES[name][0](data)
+        plt.show()
 
     def plot_income_by_video(self):
         """
         plot the income by video
         :return:
         """
-        sorted_data = {k: v for k, v in sorted(self.income_by_video.items())}
-        plt.figure(figsize=(18, 11))
-        plt.plot(sorted_data.keys(), sorted_data.values(), 'o-', color='#960019')
-        plt.xticks([])
-        plt.yticks(size=16)
-        plt.title('Income by video in USD', size=24)
-        plt.xlabel('Video', size=20)
-        plt.ylabel('Income in USD', size=20)
-        plt.show()
+        self.show_figure('income_by_video', self.income_by_video)
 
     def plot_income_by_month(self):
         """
         plot the income by month
         :return:
         """
-        sorted_data = {k: v for k, v in sorted(self.income_by_month.items())}
-        plt.figure(figsize=(16, 11))
-        plt.plot(sorted_data.keys(), sorted_data.values(), 's-', color='#960019')
-        plt.xticks(rotation=45, size=16)
-        plt.yticks(size=16)
-        plt.title('Income by month in USD', size=24)
-        plt.xlabel('Month', size=20)
-        plt.ylabel('Income in USD', size=20)
-        plt.show()
+        self.show_figure('income_by_month', self.income_by_month)
 
     def plot_income_by_currency(self):
         """
         plot the income by currency
         :return:
         """
-        sorted_data = {k: v for k, v in sorted(self.income_usd_by_currency.items(), key=lambda x: x[1], reverse=True)}
-        plt.figure(figsize=(16, 11))
-        plt.bar(sorted_data.keys(), sorted_data.values(), color='#960019')
-        plt.xticks(rotation=45, size=12)
-        plt.yticks(size=16)
-        plt.title('Income by currency in USD', size=24)
-        plt.xlabel('Currency', size=20)
-        plt.ylabel('Income in USD', size=20)
-        plt.show()
+        self.show_figure('income_by_currency', self.income_usd_by_currency)
+
+    def plot_income_over_stream(self):
+        """
+        plot the average share of the income earned over the duration of a stream
+        :return:
+        """
+        self.show_figure('income_over_stream', self.get_income_over_stream())
 
     def plot_word_cloud(self):
         """
         plot the word cloud of the chat
         :return:
         """
-        # Create the word cloud
-        wordcloud = WordCloud(width=1600, height=800, background_color='white').generate(self.word_cloud_data)
-        # Display the word cloud
-        plt.figure(figsize=(16, 9))
-        plt.imshow(wordcloud, interpolation='bilinear')
-        plt.axis('off')
-        plt.show()
+        self.show_figure('word_cloud', self.word_cloud_data.get_counts())
 
-    def analysis_membership(self):
+    def summarize_membership(self):
         """
-        analysis the membership of the channel, plot a bar plot of the membership length
+        analysis the membership of the channel and add the numbers to all_prints
         """
-        self.total_membership_revenue = np.sum(self.membership) * self.MEMBERSHIP_PRICE
-        total_num_of_members = len(self.membership)
-        average_membership_length = np.mean(self.membership)
+        self.total_membership_revenue = self.membership.get_revenue(self.MEMBERSHIP_PRICE)
+        total_num_of_members = self.membership.get_member_count()
+        average_membership_length = self.membership.get_average_length()
         self.all_prints.append(f'Total number of unique members: {total_num_of_members}')
         self.all_prints.append(f'Total membership revenue: ${self.total_membership_revenue:.2f}')
         self.all_prints.append(f'Average membership length: {average_membership_length:.4f} months')
-        # generate bar plot data
-        unique_arr = np.unique(self.membership)
-        distro_arr = np.empty((0, 2))
-        for i in unique_arr:
-            distro_arr = np.append(distro_arr, np.array([[i, np.count_nonzero(self.membership == i)]]), axis=0)
-        plt.bar(distro_arr[:, 0].astype(int).astype(str), distro_arr[:, 1], color='#960019')  # plot bar plot
-        # add bar height to the bar plot
-        for i, v in enumerate(distro_arr[:, 1]):
-            plt.text(i, v + 0.5, str(v.astype(int)), ha='center', fontweight='bold')
-        plt.xlabel('Membership Length (Months)')
-        plt.ylabel('Number of Members')
-        plt.title('Membership Length Distribution')
-        plt.show()
+        tier_labels, tier_counts = self.membership.get_tier_counts()
+        self.all_prints.append('Members by tier: ' + ', '.join(f'{label} months: {count}' for label, count in
+                                                                zip(tier_labels, tier_counts)))
+
+    def analysis_membership(self):
+        """
+        analysis the membership of the channel, plot a bar plot of the membership length
+        """
+        self.summarize_membership()
+        # plot bar plot of the distribution
+        self.show_figure('membership_distribution', {'lengths': self.membership.lengths.tolist(),
+                                                     'counts': self.membership.counts.tolist()})
 
 
-ca = ChatAnalysis()
-ca.analysis_all()
+if __name__ == '__main__':
+    import sys
+    ca = ChatAnalysis(streaming='--streaming' in sys.argv)
+    if '--report' in sys.argv:
+        # headless, e.g. on a server or in cron
+        ca.write_report()
+    else:
+        ca.analysis_all()
@@ -0,0 +1,219 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: ChatArchive.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 9/16/23 14:27
+"""
+import gzip
+import io
+import json
+import os
+import threading
+
+from Metrics import metrics
+
+# Compressed archive of the paid messages of all videos of a chat folder
+#     chats.archive:       gzip members one after another, one member per video with json lines,
+#                          the metadata of the video on the first line and one message per line after it
+#     chats.archive.index: json {video id: [offset, length]} of the member of every video
+# A video is read by decompressing only its own member. Rewriting a video appends a new member,
+# the old one stays unused until the archive is compacted.
+# In the chat folder an archived video is named <video id>.jsonl, a path that does not exist on disk.
+ARCHIVE_FILE = 'chats.archive'
+INDEX_FILE = 'chats.archive.index'
+SUFFIX = '.jsonl'
+
+write_lock = threading.Lock()
+archives = {}  # chat path -> (modified time of the index, ChatArchive)
+
+
+def is_archived(file_name):
+    """
+    :param file_name: path of a chat file
+    :return: True if the path names a video in the archive of its folder
+    """
+    return file_name.endswith(SUFFIX)
+
+
+def get_archive(file_name):
+    """
+    get the archive of the folder of an archived video, loaded again when its index changed
+    :param file_name: path <chat path><video id>.jsonl
+    :return: ChatArchive, video id
+    """
+    chat_path = os.path.join(os.path.dirname(file_name), '')
+    vid = os.path.basename(file_name)[:-len(SUFFIX)]
+    try:
+        index_time = os.stat(chat_path + INDEX_FILE).st_mtime_ns
+    except FileNotFoundError:
+        index_time = None
+    if chat_path not in archives or archives[chat_path][0] != index_time:
+        archives[chat_path] = (index_time, ChatArchive(chat_path))
+    return archives[chat_path][1], vid
+
+
+class ChatArchive:
+    """
+    Random access to the paid messages of a video in the compressed archive of a chat folder
+    """
+
+    def __init__(self, chat_path='chats/'):
+        """
+        :param chat_path: path to the chat folder
+        """
+        self.chat_path = chat_path
+        self.archive_file = chat_path + ARCHIVE_FILE
+        self.index_file = chat_path + INDEX_FILE
+        self.index = self.read_index()
+
+    def read_index(self):
+        """
+        :return: {video id: [offset, length]}
+        """
+        try:
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_index(self, index):
+        """
+        replace the index atomically
+        :param index: {video id: [offset, length]}
+        """
+        temp_path = self.index_file + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps(index))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.index_file)
+        self.index = index
+
+    def get_videos(self):
+        """
+        :return: sorted names <video id>.jsonl of the archived videos
+        """
+        return sorted(vid + SUFFIX for vid in self.index)
+
+    def get_signature(self, vid):
+        """
+        :param vid: video id
+        :return: [offset, length] of the member of the video, changes when the video is rewritten
+        """
+        return list(self.index[vid])
+
+    def append(self, vid, messages, metadata):
+        """
+        add or replace the paid messages of a video
+        :param vid: video id
+        :param messages: list of {"time", "money", "msg", "membership"}
+        :param metadata: metadata of the video
+        """
+        lines = [json.dumps(metadata)] + [json.dumps(msg_data) for msg_data in messages]
+        data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), mtime=0)
+        with write_lock, metrics.timer('archive.append'):
+            index = self.read_index()  # another ChatArchive of the folder may have appended
+            with open(self.archive_file, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            index[vid] = [offset, len(data)]
+            self.write_index(index)
+
+    def iter_lines(self, vid):
+        """
+        decompress the member of a video one line at a time
+        :param vid: video id
+        :return: generator of the metadata, then the messages
+        """
+        offset, length = self.index[vid]
+        with open(self.archive_file, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as member:
+            for line in member:
+                yield json.loads(line)
+
+    def read(self, vid):
+        """
+        :param vid: video id
+        :return: metadata dict, list of {"time", "money", "msg", "membership"}
+        """
+        with metrics.timer('chat.read.archive'):
+            lines = self.iter_lines(vid)
+            metadata = next(lines)
+            return metadata, list(lines)
+
+    def compact(self):
+        """
+        rewrite the archive without the members of rewritten videos
+        """
+        with write_lock:
+            if not os.path.exists(self.archive_file) or not os.path.exists(self.index_file):
+                return  # nothing archived yet
+            index = self.read_index()
+            temp_path = self.archive_file + '.tmp'
+            new_index = {}
+            with open(self.archive_file, 'rb') as old, open(temp_path, 'wb') as new:
+                for vid, (offset, length) in sorted(index.items(), key=lambda item: item[1][0]):
+                    old.seek(offset)
+                    new_index[vid] = [new.tell(), length]
+                    new.write(old.read(length))
+                new.flush()
+                os.fsync(new.fileno())
+            os.replace(temp_path, self.archive_file)
+            self.write_index(new_index)
+
+
+def columns_to_messages(columns):
+    """
+    turn the columns of a .npz file back into paid messages in the json export format
+    :param columns: dict of numpy arrays, see PaidChatColumns
+    :return: list of {"time", "money", "msg", "membership"}
+    """
+    from PaidChatColumns import get_texts
+    currencies = columns['currencies'].tolist()
+    return [{"time": float(time), "money": {"amount": float(amount), "currency": currencies[currency]},
+             "msg": text or None, "membership": int(membership)}
+            for time, amount, currency, membership, text in zip(columns['time'], columns['amount'],
+                                                                 columns['currency'], columns['membership'],
+                                                                 get_texts(columns))]
+
+
+def migrate_chat_dir(chat_path='chats/', remove=True):
+    """
+    move the .json and .npz files of a chat folder into its archive, the json export is used if both exist
+    :param chat_path: path to the chat folder
+    :param remove: delete the files once the archived copy is read back and checked
+    """
+    from PaidChatColumns import read_paid_chat_columns
+    archive = ChatArchive(chat_path)
+    file_list = os.listdir(chat_path)
+    vids = sorted({video.rsplit('.', 1)[0] for video in file_list if video.endswith(('.json', '.npz'))})
+    for count, vid in enumerate(vids, 1):
+        if vid + '.json' in file_list:
+            with open(f'{chat_path}{vid}.json', 'r') as f:
+                chat_data = json.load(f)
+            metadata = chat_data.pop('metadata')
+            messages = list(chat_data.values())
+        else:
+            metadata, columns = read_paid_chat_columns(f'{chat_path}{vid}.npz')
+            messages = columns_to_messages(columns)
+        archive.append(vid, messages, metadata)
+        archived_metadata, archived_messages = archive.read(vid)
+        if archived_metadata != metadata or archived_messages != messages:
+            raise ValueError(f'the archived copy of {vid} does not match, {chat_path} is left unchanged for it')
+        if remove:
+            for extension in ('.json', '.npz'):
+                if vid + extension in file_list:
+                    os.remove(chat_path + vid + extension)
+        print('\r', 'Archiving: ', count, '/', len(vids), end='')
+    print('')
+    archive.compact()
+
+
+if __name__ == '__main__':
+    migrate_chat_dir()
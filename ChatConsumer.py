@@ -0,0 +1,261 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: ChatConsumer.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 5/14/23 15:02
+"""
+import json
+import os
+
+from BadgeParser import get_member_period
+from ChatArchive import ChatArchive
+from Metrics import metrics
+from PaidChatColumns import write_paid_chat_columns
+
+# all the message types of ChatDownloader the consumers can use
+ALL_MESSAGE_TYPES = ('text_message',
+                     'membership_item',
+                     'paid_message',
+                     'paid_sticker',
+                     'sponsorships_gift_purchase_announcement',
+                     'ticker_paid_sticker_item',
+                     'ticker_paid_message_item',
+                     'ticker_sponsor_item',
+                     'banner',
+                     'banner_header',
+                     'donation_announcement')
+# the message types that can carry money
+PAID_MESSAGE_TYPES = ('paid_message',
+                      'paid_sticker',
+                      'ticker_paid_sticker_item',
+                      'ticker_paid_message_item',
+                      'donation_announcement')
+
+
+def get_message_types(consumers):
+    """
+    get the message types to download for some consumers
+    :param consumers: list of ChatConsumer
+    :return: list of message types needed by at least one consumer, in the order of ALL_MESSAGE_TYPES
+    """
+    needed = set()
+    for consumer in consumers:
+        needed.update(consumer.MESSAGE_TYPES)
+    return [message_type for message_type in ALL_MESSAGE_TYPES if message_type in needed]
+
+
+class ChatConsumer:
+    """
+    A consumer gets every de-duplicated message of one video that passes its accepts check,
+    so all the outputs come from one download
+    """
+    NAME = None
+    # message types this consumer needs, only the types needed by a consumer are downloaded
+    MESSAGE_TYPES = ALL_MESSAGE_TYPES
+
+    def accepts(self, message):
+        """
+        cheap check on the raw message before any parsing, consume is only called if it passes
+        :param message: message dict from ChatDownloader
+        :return: True if the message is useful for this consumer
+        """
+        return True
+
+    def consume(self, message):
+        """
+        process one message
+        :param message: message dict from ChatDownloader
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        called once after the last message of the video, write the output here
+        """
+        raise NotImplementedError
+
+    def get_state(self):
+        """
+        get the partial result, saved to the checkpoint so an interrupted download can be resumed
+        :return: json serializable state
+        """
+        raise NotImplementedError
+
+    def set_state(self, state):
+        """
+        restore the partial result from a checkpoint
+        :param state: state returned by get_state
+        """
+        raise NotImplementedError
+
+
+class PaidChatConsumer(ChatConsumer):
+    """
+    record all the paid messages of a video to chats/<video id>.json, or .npz in the columnar format,
+    or into the compressed archive of the chat folder
+    """
+    NAME = 'paid'
+    MESSAGE_TYPES = PAID_MESSAGE_TYPES
+
+    def __init__(self, url, metadata, chat_path='chats/', columnar=False, archive=False):
+        """
+        :param url: url of the video
+        :param metadata: metadata of the video, saved along with the paid messages
+        :param chat_path: path to the chat folder
+        :param columnar: write the columnar .npz format of PaidChatColumns instead of json
+        :param archive: append to the archive of ChatArchive instead of writing a file
+        """
+        self.url = url
+        self.metadata = metadata
+        self.chat_path = chat_path
+        self.columnar = columnar
+        self.archive = archive
+        self.msg_counter = 0
+        self.chat_dict = {}
+
+    def accepts(self, message):
+        return 'money' in message  # remove non-money messages
+
+    def consume(self, message):
+        period = get_member_period(message) or 0
+        #  add message to the chat dictionary
+        self.chat_dict[self.msg_counter] = {"time": message['time_in_seconds'],
+                                            "money": message['money'],
+                                            "msg": message['message'],
+                                            "membership": period}
+        self.msg_counter += 1
+
+    def finish(self):
+        metrics.count('chat.paid_messages', self.msg_counter)
+        with metrics.timer('chat.write'):
+            if self.archive:
+                ChatArchive(self.chat_path).append(self.url[-11:], list(self.chat_dict.values()),
+                                                   {**self.metadata, "msg_count": self.msg_counter})
+                self.remove_other_files(None)
+                return
+            if self.columnar:
+                write_paid_chat_columns(f'{self.chat_path}{self.url[-11:]}.npz', list(self.chat_dict.values()),
+                                        {**self.metadata, "msg_count": self.msg_counter})
+                self.remove_other_files('.npz')
+                return
+            self.chat_dict['metadata'] = {**self.metadata, "msg_count": self.msg_counter}
+            with open(f'{self.chat_path}{self.url[-11:]}.json', 'w') as f:
+                f.write(json.dumps(self.chat_dict, indent=2))
+            self.remove_other_files('.json')
+
+    def remove_other_files(self, keep):
+        """
+        remove the files of this video in the other formats, ChatAnalysis would read a stale .npz instead of
+        a new .json, and any loose file instead of the archive
+        :param keep: extension of the file just written, None if the messages went to the archive
+        """
+        for extension in ('.json', '.npz'):
+            file_name = f'{self.chat_path}{self.url[-11:]}{extension}'
+            if extension != keep and os.path.exists(file_name):
+                os.remove(file_name)
+
+    def get_state(self):
+        return {"msg_counter": self.msg_counter, "chat_dict": dict(self.chat_dict)}
+
+    def set_state(self, state):
+        self.msg_counter = state['msg_counter']
+        # json turns the message counters into strings
+        self.chat_dict = {int(k): v for k, v in state['chat_dict'].items()}
+
+
+class MembershipConsumer(ChatConsumer):
+    """
+    find the longest membership period of every member in a video
+    """
+    NAME = 'membership'
+    # badges of chatters, without the tickers, banners and donations that repeat or have no member
+    MESSAGE_TYPES = ('text_message', 'membership_item', 'paid_message', 'paid_sticker',
+                     'sponsorships_gift_purchase_announcement')
+
+    def __init__(self, url, merge_member_list):
+        """
+        :param url: url of the video
+        :param merge_member_list: function called with the url and {member id: months} of this video when it is finished
+        """
+        self.url = url
+        self.merge_member_list = merge_member_list
+        self.member_dict_for_vid = {}
+
+    def accepts(self, message):
+        # the membership period is only in the badges, most chatters have none
+        author = message['author']
+        return 'badges' in author and 'id' in author
+
+    def consume(self, message):
+        period = get_member_period(message)
+        if period is None:
+            return
+        user_id = message['author']['id']
+        #  update the membership period for this video
+        if user_id not in self.member_dict_for_vid or period > self.member_dict_for_vid[user_id]:
+            self.member_dict_for_vid[user_id] = period
+
+    def finish(self):
+        self.merge_member_list(self.url, self.member_dict_for_vid)
+
+    def get_state(self):
+        return dict(self.member_dict_for_vid)
+
+    def set_state(self, state):
+        self.member_dict_for_vid = dict(state)
+
+
+class TextStatsConsumer(ChatConsumer):
+    """
+    count messages, chatters and text length of a video, saved to stats/<video id>.json
+    """
+    NAME = 'stats'
+
+    def __init__(self, url, stats_path='stats/'):
+        """
+        :param url: url of the video
+        :param stats_path: path to the stats folder
+        """
+        self.url = url
+        self.stats_path = stats_path
+        self.message_count = 0
+        self.text_message_count = 0
+        self.text_length = 0
+        self.message_types = {}
+        self.authors = set()
+
+    def consume(self, message):
+        self.message_count += 1
+        message_type = message.get('message_type', 'unknown')
+        self.message_types[message_type] = self.message_types.get(message_type, 0) + 1
+        if 'id' in message['author']:
+            self.authors.add(message['author']['id'])
+        if message_type == 'text_message' and message.get('message'):
+            self.text_message_count += 1
+            self.text_length += len(message['message'])
+
+    def finish(self):
+        stats = {"message_count": self.message_count,
+                 "text_message_count": self.text_message_count,
+                 "text_length": self.text_length,
+                 "unique_authors": len(self.authors),
+                 "message_types": self.message_types}
+        os.makedirs(self.stats_path, exist_ok=True)
+        with open(f'{self.stats_path}{self.url[-11:]}.json', 'w') as f:
+            f.write(json.dumps(stats, indent=2))
+
+    def get_state(self):
+        return {"message_count": self.message_count,
+                "text_message_count": self.text_message_count,
+                "text_length": self.text_length,
+                "message_types": dict(self.message_types),
+                "authors": list(self.authors)}
+
+    def set_state(self, state):
+        self.message_count = state['message_count']
+        self.text_message_count = state['text_message_count']
+        self.text_length = state['text_length']
+        self.message_types = dict(state['message_types'])
+        self.authors = set(state['authors'])
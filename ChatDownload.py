@@ -7,194 +7,342 @@
 @time: 4/23/23 17:50
 """
 import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 import backoff
-import chat_downloader.errors
-import pytube
-from chat_downloader import ChatDownloader
-from pytube import YouTube
 
+from ChatConsumer import PaidChatConsumer, MembershipConsumer, TextStatsConsumer, get_message_types
 from LocalCache import LocalCache
+from MembershipIndex import MembershipIndex
+from Metrics import metrics
+from SeenSet import SeenSet
+from MetadataFetcher import MetadataFetcher
+from TalentRegistry import Talent
 
 
-def get_month(period_txt):
+class ChatDownloaderSource:
     """
-    give a text description of period, return the number of months
-    :param period_txt:
-    :return: number of months
+    the real chat source, ChatDownloader is only loaded when a chat is downloaded
     """
-    if "month" in period_txt:
-        return int(period_txt[:period_txt.find(" ")])
-    elif "year" in period_txt:
-        return int(period_txt[:period_txt.find(" ")]) * 12
+
+    def get_chat(self, url, start_time=None, message_types=None):
+        from chat_downloader import ChatDownloader
+        return ChatDownloader().get_chat(url, start_time=start_time, message_types=message_types)
 
 
 class ChatDownload:
     VTUBER_NAME = 'voxakuma'
-    URL_LIST_NAME = f'all_videos_{VTUBER_NAME}.txt'
-    METADATA_NAME = f'all_metadata_{VTUBER_NAME}.txt'
     BASE_URL = 'https://www.youtube.com/watch?v='
-    METADATA_CACHE = f'metadata_cache_{VTUBER_NAME}.json'
-    MEMBER_MASTER_LIST = 'member_list.json'
+    CHECKPOINT_EVERY = 50000  # messages, the consumer states of a long stream take a while to write
 
-    def __init__(self):
-        self.metadata_cache = LocalCache(self.METADATA_CACHE)
-        self.chat = None
+    def __init__(self, consumers=('paid', 'membership', 'stats'), paid_format='json', talent=None,
+                 metadata_cache=None, metadata_provider=None, chat_source=None):
+        """
+        :param consumers: outputs to generate from each chat download, any of 'paid', 'membership' and 'stats'
+        :param paid_format: 'json', 'npz' or 'archive', file format of the paid messages,
+            see PaidChatColumns and ChatArchive
+        :param talent: Talent whose videos are downloaded, VTUBER_NAME in the working folder if None
+        :param metadata_cache: LocalCache of metadata shared with other talents in this process,
+            the metadata cache file of the talent if None
+        :param metadata_provider: where video metadata comes from, see MetadataFetcher, pytube if None
+        :param chat_source: object with get_chat(url, start_time, message_types), ChatDownloader if None,
+            see Replay.ReplayChatSource to record and replay chats
+        """
+        self.metadata_provider = metadata_provider
+        self.chat_source = chat_source if chat_source is not None else ChatDownloaderSource()
+        self.consumers = consumers
+        self.paid_format = paid_format
+        self.talent = talent if talent is not None else Talent.legacy(self.VTUBER_NAME)
+        self.talent.make_dirs()
+        if metadata_cache is None:
+            metadata_cache = LocalCache(self.talent.metadata_cache)
+        self.metadata_cache = metadata_cache
+        self.checkpoint = LocalCache(self.talent.checkpoint_cache)
+        # consumer states of partially downloaded videos, one file per video next to the checkpoint cache
+        self.state_path = os.path.splitext(self.talent.checkpoint_cache)[0] + '_state/'
+        self.member_index = MembershipIndex(self.talent.member_list)
         self.urls = self.get_url_list()
         self.ids = self.get_vid_list()
 
     def get_url_list(self):
         url_list = []
-        with open(self.URL_LIST_NAME, 'r') as f:
+        with open(self.talent.video_list, 'r') as f:
             for line in f.readlines():
                 url_list.append(self.BASE_URL + line.strip('\n'))
         return url_list
 
     def get_vid_list(self):
         id_list = []
-        with open(self.URL_LIST_NAME, 'r') as f:
+        with open(self.talent.video_list, 'r') as f:
             for line in f.readlines():
                 id_list.append(line.strip('\n'))
         return id_list
 
-    @backoff.on_exception(backoff.expo, (pytube.exceptions.PytubeError, ValueError), max_time=60)
-    def get_metadata(self):
+    def get_metadata(self, workers=2, rate=1 / 3):
         """
         get metadata for all videos
+        :param workers: number of threads fetching metadata
+        :param rate: max number of requests per second to YouTube
         :return:
         """
-        metadata_all = {}
-        for url in self.urls:
-            if self.metadata_cache.is_in_cache(url):
-                metadata_all[url] = self.metadata_cache.get_local_cache(url)
-            else:
-                yt = YouTube(url)
-                metadata = {
-                    'title': yt.title,
-                    'publish_date': yt.publish_date.strftime('%Y-%m-%d'),
-                    'views': yt.views,
-                    'duration': yt.length
-                }
-                self.metadata_cache.set_local_cache(url, metadata)
-                metadata_all[url] = metadata
-                time.sleep(3)
-        with open(self.METADATA_NAME, 'w') as f:
+        fetcher = MetadataFetcher(self.metadata_cache, self.metadata_provider, rate=rate, workers=workers)
+        with metrics.stage('metadata'):
+            metadata_all = fetcher.fetch_all(self.urls)
+        with open(self.talent.metadata_file, 'w') as f:
             json.dump(metadata_all, f)
 
-    def get_all_chat(self):
+    def get_all_chat(self, workers=1):
         """
-        get chat for all videos
+        get chat for all videos, several videos can be downloaded at once with a thread pool.
+        videos finished in an earlier run are skipped and partially downloaded videos are resumed,
+        so new entries of the url list are processed incrementally
+        :param workers: max number of videos downloaded at the same time, 1 means sequential
         :return:
         """
-        count = 0
-        for url in self.urls:
-            try:
-                self.get_chat(url)
-                count += 1
-                print(f'{count} videos done, UID {url[-11:]}')
-            except chat_downloader.errors.ChatDownloaderError:
+        from chat_downloader.errors import ChatDownloaderError, RetriesExceeded
+        self.urls = self.get_url_list()
+        self.ids = self.get_vid_list()
+        todo_urls = [url for url in self.urls if not self.is_chat_finished(url[-11:])]
+        count = len(self.urls) - len(todo_urls)
+        print(f'[{self.talent.name}] {count} videos already done, {len(todo_urls)} videos to download')
+        if 'paid' in self.consumers:
+            missing = [url for url in todo_urls if not self.metadata_cache.is_in_cache(url)]
+            if missing:
+                # the paid messages are saved with the metadata, they are downloaded in a later run once it is fetched
+                print(f'[{self.talent.name}] {len(missing)} videos without metadata, their paid messages are skipped')
+        with metrics.stage('download'), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(self.download_chat, url) for url in todo_urls]
+            # report progress in the order of the url list, no matter which download finishes first
+            for url, future in zip(todo_urls, futures):
                 count += 1
-                print(f'{count} videos skipped, URL {url}')
-                continue
+                try:
+                    future.result()
+                    print(f'[{self.talent.name}] {count} videos done, UID {url[-11:]}')
+                except RetriesExceeded:
+                    # network problem, not recorded in the checkpoint so the next run tries again
+                    print(f'[{self.talent.name}] {count} videos failed, URL {url}')
+                except ChatDownloaderError:
+                    self.set_checkpoint(url[-11:], {'status': 'skipped'})
+                    print(f'[{self.talent.name}] {count} videos skipped, URL {url}')
+                    continue
+        self.member_index.flush()
+        self.checkpoint.flush()
 
-    def get_chat(self, url):
+    def get_finished_consumers(self, vid):
         """
-        get chat obj for a single video
-        :param url: url of the video
+        get the consumers whose output of a video was written in an earlier run
+        :param vid: video id
+        :return: set of consumer names
+        """
+        if not self.checkpoint.is_in_cache(vid):
+            return set()
+        progress = self.checkpoint.get_local_cache(vid)
+        finished = set(progress.get('finished', []))
+        if progress['status'] == 'done':
+            finished.update(progress.get('consumers', []))
+        if 'membership' in finished and not self.member_index.has_video(vid):
+            # the member list is written periodically, a video finished after the last write has to be redone
+            finished.discard('membership')
+        return finished
+
+    def is_chat_finished(self, vid):
+        """
+        check if the chat of a video was skipped, or finished for all the requested consumers, in an earlier run
+        :param vid: video id
+        :return: True if there is nothing left to download
+        """
+        if not self.checkpoint.is_in_cache(vid):
+            return False
+        if self.checkpoint.get_local_cache(vid)['status'] == 'skipped':
+            return True
+        return set(self.consumers) <= self.get_finished_consumers(vid)
+
+    def set_checkpoint(self, vid, progress):
+        """
+        save the download progress of a video
+        :param vid: video id
+        :param progress: dict with status 'partial', 'done' or 'skipped', and the names of the consumers it covers
         :return:
         """
-        self.chat = ChatDownloader().get_chat(url, message_types=['text_message',
-                                                                  'membership_item',
-                                                                  'paid_message',
-                                                                  'paid_sticker',
-                                                                  'sponsorships_gift_purchase_announcement',
-                                                                  'ticker_paid_sticker_item',
-                                                                  'ticker_paid_message_item',
-                                                                  'ticker_sponsor_item',
-                                                                  'banner',
-                                                                  'banner_header',
-                                                                  'donation_announcement'])
-        #self.record_paid_chat(url)  # do not need to run again
-        self.record_membership()
-
-    def record_paid_chat(self, url):
-        msg_counter = 0
-        chat_dict = {}
-        last_msg_id = ''
-        for message in self.chat:  # iterate over messages
-            if message['message_id'] != last_msg_id:  # remove duplicate messages
-                last_msg_id = message['message_id']
-                if 'money' in message:  # remove non-money messages
-                    period = 0
-                    if 'badges' in message['author'] and "ember" in message['author']['badges'][0]['title']:
-                        #  check if the message is from a member
-                        title = message['author']['badges'][0]['title']
-                        #  calculate the membership period in months
-                        if 'New' in title:
-                            period = 1  # default new member to 1 month
-                        else:
-                            period = get_month(title[title.find("(") + 1:title.find(")")])
-                    #  add message to the chat dictionary
-                    chat_dict[msg_counter] = {"time": message['time_in_seconds'],
-                                              "money": message['money'],
-                                              "msg": message['message'],
-                                              "membership": period}
-                    msg_counter += 1
-        chat_dict['metadata'] = {**self.metadata_cache.get_local_cache(url), "msg_count": msg_counter}
-        with open(f'chats/{url[-11:]}.json', 'w') as f:
-            f.write(json.dumps(chat_dict, indent=2))
-
-    def record_membership(self):
-        member_dict_for_vid = {}
-        last_msg_id = ''
-        for message in self.chat:  # iterate over messages
-            if message['message_id'] != last_msg_id:  # remove duplicate messages
-                last_msg_id = message['message_id']
-                if 'id' in message['author'] and 'badges' in message['author'] and "ember" in message['author']['badges'][0]['title']:
-                    #  check if the message is from a member
-                    period = 0  # default period to 0 months
-                    user_id = message['author']['id']
-                    title = message['author']['badges'][0]['title']
-                    #  calculate the membership period in months
-                    if 'New' in title:
-                        period = 1  # default new member to 1 month
-                    else:
-                        period = get_month(title[title.find("(") + 1:title.find(")")])
-                    #  update the membership period for this video
-                    if user_id not in member_dict_for_vid:
-                        member_dict_for_vid[user_id] = period
-                    else:
-                        if period > member_dict_for_vid[user_id]:
-                            member_dict_for_vid[user_id] = period
-        #  update the membership period for all videos
-        all_member = self.read_member_master_list()
-        #  update the member period
-        for member in member_dict_for_vid:
-            if member not in all_member:
-                all_member[member] = member_dict_for_vid[member]
-            elif member_dict_for_vid[member] > all_member[member]:
-                all_member[member] = member_dict_for_vid[member]
-        self.write_member_master_list(all_member)
-
-    def read_member_master_list(self):
+        self.checkpoint.set_local_cache(vid, progress)
+        self.checkpoint.flush()
+
+    def read_state(self, vid, offset):
+        """
+        read the consumer states of a partially downloaded video
+        :param vid: video id
+        :param offset: number of messages processed at the checkpoint
+        :return: {consumer name: state}, None if the states are missing or do not belong to the checkpoint
+        """
         try:
-            with open(f'membership/{self.MEMBER_MASTER_LIST}', 'r') as file:
-                data = json.load(file)
-        except FileNotFoundError:
-            with open(f'membership/{self.MEMBER_MASTER_LIST}', 'w') as file:
-                data = {}
-                json.dump(data, file)
-        return data
+            with open(f'{self.state_path}{vid}.json', 'r') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # the states are written before the checkpoint, a crash in between leaves states that are ahead of it
+        return saved['state'] if saved['offset'] == offset else None
 
-    def write_member_master_list(self, data):
-        with open(f'membership/{self.MEMBER_MASTER_LIST}', 'w') as file:
-            file.write(json.dumps(data, indent=2))
+    def write_state(self, vid, offset, state):
+        """
+        replace the consumer states of a video atomically, before the checkpoint that refers to them is saved
+        :param vid: video id
+        :param offset: number of messages processed
+        :param state: {consumer name: state}
+        """
+        os.makedirs(self.state_path, exist_ok=True)
+        file_name = f'{self.state_path}{vid}.json'
+        with metrics.timer('chat.checkpoint_state'), open(file_name + '.tmp', 'w') as f:
+            f.write(json.dumps({'offset': offset, 'state': state}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file_name + '.tmp', file_name)
 
+    def download_chat(self, url):
+        """
+        download and record chat for a single video, retry with backoff if the download keeps failing
+        :param url: url of the video
+        :return:
+        """
+        from chat_downloader.errors import RetriesExceeded
+        # runs in the thread pool of get_all_chat, profiled separately from the thread of the download stage
+        with metrics.profile_worker('download'):
+            backoff.on_exception(backoff.expo, RetriesExceeded, max_time=60)(self.get_chat)(url)
 
+    def get_chat(self, url):
+        """
+        get chat obj for a single video, resume from the last checkpoint if the video was partially downloaded
+        :param url: url of the video
+        :return:
+        """
+        vid = url[-11:]
+        # only the consumers that have not finished this video in an earlier run
+        finished = self.get_finished_consumers(vid)
+        consumers = self.get_consumers(url, [name for name in self.consumers if name not in finished])
+        progress = self.checkpoint.get_local_cache(vid) if self.checkpoint.is_in_cache(vid) else None
+        start_time = None
+        state = None
+        if progress is not None and progress['status'] == 'partial' and \
+                all(consumer.NAME in progress.get('consumers', []) for consumer in consumers):
+            state = self.read_state(vid, progress['offset'])
+        if state is not None:
+            for consumer in consumers:
+                consumer.set_state(state[consumer.NAME])
+            if progress['time'] > 0:
+                start_time = progress['time']
+        else:
+            # a consumer without saved state needs the chat from the beginning
+            progress = None
+        if not consumers:
+            return  # only the paid messages are left and the video has no metadata
+        message_types = get_message_types(consumers)
+        metrics.count('chat.requested_types', len(message_types))
+        chat = self.chat_source.get_chat(url, start_time=start_time, message_types=message_types)
+        self.record_chat(url, chat, consumers, progress, finished)
 
+    def get_consumers(self, url, names=None):
+        """
+        create the consumers that turn the chat of a video into output files
+        :param url: url of the video
+        :param names: names of the consumers to create, all the consumers of this download if None
+        :return: list of ChatConsumer, without the paid message consumer if the video has no metadata
+        """
+        names = self.consumers if names is None else names
+        consumers = []
+        if 'paid' in names and self.metadata_cache.is_in_cache(url):
+            consumers.append(PaidChatConsumer(url, self.metadata_cache.get_local_cache(url), self.talent.chat_path,
+                                              columnar=self.paid_format == 'npz',
+                                              archive=self.paid_format == 'archive'))
+        if 'membership' in names:
+            consumers.append(MembershipConsumer(url, self.merge_member_list))
+        if 'stats' in names:
+            consumers.append(TextStatsConsumer(url, self.talent.stats_path))
+        return consumers
 
+    def record_chat(self, url, chat, consumers, progress=None, finished=()):
+        """
+        iterate over the chat once and feed every message to all the consumers,
+        the consumer states are saved every CHECKPOINT_EVERY messages, to a state file of the video
+        that is replaced every time, the checkpoint cache only keeps the position in the chat
+        :param url: url of the video
+        :param chat: chat obj of a single video
+        :param consumers: list of ChatConsumer
+        :param progress: partial checkpoint to resume from, None to start from the beginning
+        :param finished: names of the consumers that finished this video in an earlier run, kept in the checkpoint
+        :return:
+        """
+        vid = url[-11:]
+        offset = 0
+        resume_time = None
+        resume_ids = set()
+        last_time = None
+        last_time_ids = []
+        if progress is not None:
+            offset = progress['offset']
+            resume_time = last_time = progress['time']
+            resume_ids = set(progress['ids'])
+            last_time_ids = list(progress['ids'])
+        seen = SeenSet()
+        filtered = [0] * len(consumers)  # messages dropped by the accepts check of every consumer
+        start_offset = offset
+        start_time = time.perf_counter()
+        for message in chat:  # iterate over messages
+            msg_id = message['message_id']
+            if not seen.is_duplicate(msg_id):  # remove duplicate messages
+                msg_time = message['time_in_seconds']
+                if resume_time is not None:
+                    # skip the messages already processed before the checkpoint
+                    if msg_time < resume_time or (msg_time == resume_time and msg_id in resume_ids):
+                        continue
+                    if msg_time > resume_time:
+                        resume_time = None
+                for i, consumer in enumerate(consumers):
+                    if consumer.accepts(message):
+                        consumer.consume(message)
+                    else:
+                        filtered[i] += 1
+                offset += 1
+                if msg_time != last_time:
+                    last_time = msg_time
+                    last_time_ids = []
+                last_time_ids.append(msg_id)
+                if offset % self.CHECKPOINT_EVERY == 0:
+                    self.write_state(vid, offset, {consumer.NAME: consumer.get_state() for consumer in consumers})
+                    self.set_checkpoint(vid, {'status': 'partial',
+                                              'offset': offset,
+                                              'time': last_time,
+                                              'ids': last_time_ids,
+                                              'consumers': [consumer.NAME for consumer in consumers],
+                                              'finished': sorted(finished)})
+        seconds = time.perf_counter() - start_time
+        for consumer in consumers:
+            consumer.finish()
+        self.set_checkpoint(vid, {'status': 'done', 'offset': offset,
+                                  'consumers': sorted(set(finished) | {consumer.NAME for consumer in consumers})})
+        if os.path.exists(f'{self.state_path}{vid}.json'):
+            os.remove(f'{self.state_path}{vid}.json')
+        metrics.count('chat.messages', offset - start_offset)
+        metrics.count('chat.duplicates', seen.duplicates)
+        for consumer, count in zip(consumers, filtered):
+            metrics.count(f'chat.filtered.{consumer.NAME}', count)
+        metrics.event('video', talent=self.talent.name, vid=vid, messages=offset - start_offset,
+                      duplicates=seen.duplicates,
+                      filtered={consumer.NAME: count for consumer, count in zip(consumers, filtered)}, seconds=round(seconds, 3),
+                      messages_per_second=round((offset - start_offset) / seconds, 1) if seconds else None)
 
+    def merge_member_list(self, url, member_dict_for_vid):
+        """
+        merge the membership period of a video into the member master list
+        :param url: url of the video
+        :param member_dict_for_vid: {member id: months} of a video
+        :return:
+        """
+        video_date = ''
+        if self.metadata_cache.is_in_cache(url):
+            video_date = self.metadata_cache.get_local_cache(url)['publish_date']
+        self.member_index.merge(url[-11:], video_date, member_dict_for_vid)
 
 
-down = ChatDownload()
-down.get_all_chat()
+if __name__ == '__main__':
+    down = ChatDownload()
+    down.get_all_chat()
@@ -0,0 +1,125 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: CurrencyConverter.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 5/21/23 14:10
+"""
+import numpy as np
+
+# currency symbols ChatDownloader may give instead of an ISO code
+CURRENCY_SYMBOLS = {
+    '$': 'USD',
+    'US$': 'USD',
+    'A$': 'AUD',
+    'CA$': 'CAD',
+    'NZ$': 'NZD',
+    'HK$': 'HKD',
+    'NT$': 'TWD',
+    'MX$': 'MXN',
+    'R$': 'BRL',
+    'S$': 'SGD',
+    '€': 'EUR',
+    '£': 'GBP',
+    '¥': 'JPY',
+    '￥': 'JPY',
+    'CN¥': 'CNY',
+    '₩': 'KRW',
+    '₫': 'VND',
+    '₹': 'INR',
+    '₱': 'PHP',
+    '₪': 'ILS',
+    '₺': 'TRY',
+    '₽': 'RUB',
+    '฿': 'THB',
+    '₴': 'UAH',
+    'zł': 'PLN',
+    'Rp': 'IDR',
+    'RM': 'MYR',
+}
+
+
+def normalize_currency(currency):
+    """
+    turn a currency symbol or code into an upper case ISO code
+    :param currency: currency symbol or code
+    :return: ISO code
+    """
+    currency = currency.strip()
+    if currency in CURRENCY_SYMBOLS:
+        return CURRENCY_SYMBOLS[currency]
+    return currency.upper()
+
+
+class CurrencyConverter:
+    """
+    Convert money to USD with the rates of a day resolved once into a vector,
+    one conversion is a dict lookup and a multiplication
+    """
+
+    def __init__(self, currency_exchange):
+        """
+        :param currency_exchange: CurrencyExchange that provides the rate table
+        """
+        self.currency_exchange = currency_exchange
+        self.rate_vectors = {}  # day -> ({ISO code: index}, USD per unit vector)
+        self.factors = {}  # (currency symbol or code, day) -> USD per unit
+
+    def get_rate_vector(self, day):
+        """
+        get the USD value of one unit of every currency on a day
+        :param day: YYYY-MM-DD
+        :return: {ISO code: index}, numpy array of USD per unit
+        """
+        if day not in self.rate_vectors:
+            rates = self.currency_exchange.rate_table.get_rates_of_day(day)
+            code_index = {code: i for i, code in enumerate(rates)}
+            usd_rate = rates.get('USD', 1)
+            vector = usd_rate / np.array(list(rates.values()), dtype=float)
+            self.rate_vectors[day] = (code_index, vector)
+        return self.rate_vectors[day]
+
+    def get_factor(self, currency, day):
+        """
+        get the USD value of one unit of a currency on a day
+        :param currency: currency symbol or code
+        :param day: YYYY-MM-DD
+        :return: USD per unit
+        """
+        key = (currency, day)
+        factor = self.factors.get(key)
+        if factor is None:
+            code = normalize_currency(currency)
+            if code == 'USD':
+                factor = 1.0
+            else:
+                code_index, vector = self.get_rate_vector(day)
+                factor = float(vector[code_index[code]])
+            self.factors[key] = factor
+        return factor
+
+    def to_usd(self, amount, currency, day):
+        """
+        convert an amount to usd
+        :param amount: amount of money
+        :param currency: currency symbol or code
+        :param day: YYYY-MM-DD
+        :return: amount in usd
+        """
+        return amount * self.get_factor(currency, day)
+
+    def to_usd_array(self, amounts, currencies, day):
+        """
+        convert an array of amounts to usd in one vectorized operation
+        :param amounts: array of amounts
+        :param currencies: array of currency symbols or codes, same length as amounts
+        :param day: YYYY-MM-DD
+        :return: numpy array of amounts in usd
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        if len(amounts) == 0:
+            return amounts
+        symbols, inverse = np.unique(np.asarray(currencies), return_inverse=True)
+        factors = np.array([self.get_factor(symbol, day) for symbol in symbols])
+        return amounts * factors[inverse]
@@ -8,8 +8,9 @@
 """
 import json
 from datetime import date
-import requests
 from LocalCache import LocalCache
+from Metrics import metrics
+from RateTable import RateTable
 
 
 def date_to_string(date_obj):
@@ -37,12 +38,28 @@ class CurrencyExchange:
     LOCAL_CACHE = 'cached_exchange_data.json'
     URL = 'https://api.exchangerate.host/convert?from='
 
-    def __init__(self):
+    def __init__(self, source=None, http=None):
+        """
+        :param source: source of the rate table, see RateTable, exchangerate.host by default
+        :param http: object with get(url) like requests, requests if None, see Replay.ReplayHttp
+        """
+        self.http = http
         self.cache = LocalCache(self.LOCAL_CACHE)
+        self.rate_table = RateTable(source)
+
+    def get_exchange_rate_on(self, from_currency, to_currency, day):
+        """
+        get exchange rate of a day from the rate table, all currencies of a day are fetched together
+        :param from_currency:
+        :param to_currency:
+        :param day: YYYY-MM-DD
+        :return: exchange rate of two currencies on that day
+        """
+        return self.rate_table.get_rate(from_currency, to_currency, day)
 
     def get_exchange_rate(self, from_currency, to_currency):
         """
-        get exchange rate from local cache or API
+        get today's exchange rate from local cache or API
         :param from_currency:
         :param to_currency:
         :return:exchange rate of two currencies
@@ -67,8 +84,12 @@ class CurrencyExchange:
         :return: exchange rate of two currencies
         """
         # get data from API
-        response = requests.get(self.URL + from_currency + '&to=' + to_currency)
-        data = response.json()
+        if self.http is None:
+            import requests
+            self.http = requests
+        with metrics.timer('api.exchange'):
+            response = self.http.get(self.URL + from_currency + '&to=' + to_currency)
+            data = response.json()
         # get exchange rate
         exchange_rate = data['info']['rate']
         return exchange_rate
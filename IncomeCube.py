@@ -0,0 +1,124 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: IncomeCube.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 8/12/23 11:36
+"""
+import datetime
+
+from LocalCache import LocalCache
+from MembershipDistribution import TIER_BUCKETS, get_tier_labels
+
+# labels of the membership buckets of the cells, bucket 0 is the paid messages of non-members
+MEMBERSHIP_LABELS = ['non-member'] + get_tier_labels(TIER_BUCKETS)
+# dimensions a query can group by
+DIMENSIONS = ('video', 'publish_date', 'month', 'week', 'duration', 'currency', 'membership')
+# values a query can sum, index in a cell
+VALUES = {'messages': 2, 'amount': 3, 'usd': 4}
+
+
+def get_week(publish_date):
+    """
+    :param publish_date: YYYY-MM-DD
+    :return: ISO week YYYY-Www
+    """
+    year, week, weekday = datetime.date.fromisoformat(publish_date).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+class IncomeCube:
+    """
+    Rollup of the paid message income of a talent, persisted with one entry per chat file:
+    {"signature", "publish_date", "month", "week", "duration",
+     "cells": [[currency code, membership bucket, messages, amount, amount in usd], ...]}.
+    An entry is only rebuilt when its chat file changed, queries never read the chat files.
+    """
+    CUBE_FILE = 'cached_income_cube.json'
+
+    def __init__(self, cube_file=CUBE_FILE):
+        """
+        :param cube_file: cache file of the cube
+        """
+        self.cache = LocalCache(cube_file)
+
+    def is_up_to_date(self, video, signature):
+        """
+        check if the entry of a chat file was built from the current file
+        :param video: file name of the video
+        :param signature: signature of the file, see PaidChatColumns.get_file_signature
+        :return: True if the entry can be used
+        """
+        return self.cache.is_in_cache(video) and self.cache.get_local_cache(video)['signature'] == signature
+
+    def get_video(self, video):
+        """
+        :param video: file name of the video
+        :return: entry of the video
+        """
+        return self.cache.get_local_cache(video)
+
+    def set_video(self, video, signature, summary, codes, usd_amounts):
+        """
+        store the entry of a video
+        :param video: file name of the video
+        :param signature: signature of the file
+        :param summary: dict returned by PaidChatColumns.summarize_paid_chat
+        :param codes: ISO code of every currency of the summary
+        :param usd_amounts: amount in usd of every cell of the summary
+        """
+        cells = [[codes[currency], bucket, messages, amount, float(usd_amount)]
+                 for (currency, bucket, messages, amount), usd_amount in zip(summary['cells'], usd_amounts)]
+        self.cache.set_local_cache(video, {'signature': signature,
+                                           'publish_date': summary['publish_date'],
+                                           'month': summary['month'],
+                                           'week': get_week(summary['publish_date']),
+                                           'duration': summary['duration'],
+                                           'cells': cells})
+
+    def remove_other_videos(self, videos):
+        """
+        remove the entries of chat files that no longer exist, e.g. the .json files of videos converted to .npz
+        or moved to the archive, so a query of all videos does not count a video twice
+        :param videos: file names of all the videos of the chat folder
+        """
+        videos = set(videos)
+        self.cache.remove_local_cache([video for video in self.cache.cached_data if video not in videos])
+
+    def flush(self):
+        """
+        save the changed entries
+        """
+        self.cache.flush()
+
+    def query(self, by=('month',), videos=None, value='usd'):
+        """
+        sum a value grouped by some dimensions, e.g. query(('month', 'membership')) for the income by month and tier
+        :param by: names of the dimensions, see DIMENSIONS
+        :param videos: file names of the videos to include, all videos in the cube if None
+        :param value: 'usd', 'amount' (in the original currency, only meaningful by currency) or 'messages'
+        :return: {key: sum}, the key is a tuple of the values of the dimensions, or the value if there is one
+        """
+        for dimension in by:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f'unknown dimension {dimension}, use one of {DIMENSIONS}')
+        value_index = VALUES[value]
+        videos = self.cache.cached_data.keys() if videos is None else videos
+        result = {}
+        for video in videos:
+            entry = self.cache.get_local_cache(video)
+            for cell in entry['cells']:
+                key = []
+                for dimension in by:
+                    if dimension == 'video':
+                        key.append(video)
+                    elif dimension == 'currency':
+                        key.append(cell[0])
+                    elif dimension == 'membership':
+                        key.append(MEMBERSHIP_LABELS[cell[1]])
+                    else:
+                        key.append(entry[dimension])
+                key = key[0] if len(key) == 1 else tuple(key)
+                result[key] = result.get(key, 0) + cell[value_index]
+        return result
@@ -6,14 +6,44 @@
 @email: rxy216@case.edu
 @time: 4/23/23 20:21
 """
+import atexit
 import json
+import os
+import threading
+
+from Metrics import metrics
 
 
 class LocalCache:
+    """
+    Key-value cache kept in RAM and persisted to a local file.
+    Updates are appended to a JSON-lines log next to the cache file and written in batches,
+    the log is compacted into the cache file once it gets long.
+    """
+    FLUSH_EVERY = 20
+    COMPACT_EVERY = 1000
 
-    def __init__(self, file_name):
-        self.cache_path = file_name
+    def __init__(self, file_name, flush_every=FLUSH_EVERY, compact_every=COMPACT_EVERY):
+        """
+        :param file_name: path of the cache file
+        :param flush_every: number of updates kept in RAM before they are appended to the log
+        :param compact_every: min number of log lines before the log is compacted into the cache file,
+                              the log may also grow to the number of cached keys so compaction stays amortized O(1)
+        """
+        # absolute path, so the pending updates written at exit go to the right file even if the working folder changed
+        self.cache_path = os.path.abspath(file_name)
+        self.log_path = self.cache_path + '.log'
+        name = os.path.basename(file_name)
+        self.hit_counter = f'cache.{name}.hit'
+        self.miss_counter = f'cache.{name}.miss'
+        self.flush_every = flush_every
+        self.compact_every = compact_every
+        self.pending = []
+        self.log_length = 0
+        self.lock = threading.RLock()
         self.cached_data = self.initiate_local_cache()
+        self.replay_log()
+        atexit.register(self.flush)
 
     def initiate_local_cache(self):
         """
@@ -30,13 +60,36 @@ class LocalCache:
                 json.dump(data, file)
         return data
 
+    def replay_log(self):
+        """
+        apply the updates in the log that have not been compacted into the cache file yet
+        """
+        try:
+            with open(self.log_path, 'r') as file:
+                for line in file:
+                    try:
+                        key, value = json.loads(line)
+                    except ValueError:
+                        # torn write of the last line, everything before it is complete,
+                        # compact now so new updates are not appended after the broken line
+                        self.compact()
+                        return
+                    self.cached_data[key] = value
+                    self.log_length += 1
+        except FileNotFoundError:
+            pass
+
     def is_in_cache(self, key):
         """
         check if data is cached
         :param key: cache key
         :return: True if cached, False if not
         """
-        return key in self.cached_data
+        if key in self.cached_data:
+            metrics.count(self.hit_counter)
+            return True
+        metrics.count(self.miss_counter)
+        return False
 
     def get_local_cache(self, key):
         """
@@ -52,8 +105,58 @@ class LocalCache:
         :param key:
         :param value:
         """
-        # update RAM cache
-        self.cached_data[key] = value
-        # update local cache
-        with open(self.cache_path, 'w') as file:
-            file.write(json.dumps(self.cached_data, indent=2))
+        with self.lock:
+            # update RAM cache
+            self.cached_data[key] = value
+            # update local cache in batches
+            self.pending.append(json.dumps([key, value]))
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+
+    def remove_local_cache(self, keys):
+        """
+        remove keys from the cache, the cache file is rewritten so this is meant for rare clean ups
+        :param keys: cache keys, missing keys are ignored
+        """
+        with self.lock:
+            removed = [key for key in keys if key in self.cached_data]
+            if not removed:
+                return
+            for key in removed:
+                del self.cached_data[key]
+            # the log has no way to remove a key, write everything to the cache file instead, the pending updates
+            # are part of it
+            self.compact()
+            self.pending = []
+
+    def flush(self):
+        """
+        append the pending updates to the log, compact the log if it is too long
+        """
+        with self.lock, metrics.timer('cache.flush'):
+            if self.pending:
+                with open(self.log_path, 'a') as file:
+                    file.write('\n'.join(self.pending) + '\n')
+                    file.flush()
+                    os.fsync(file.fileno())
+                self.log_length += len(self.pending)
+                self.pending = []
+            if self.log_length >= max(self.compact_every, len(self.cached_data)):
+                self.compact()
+
+    def compact(self):
+        """
+        write all cached data to the cache file and clear the log,
+        the cache file is replaced atomically so a crash never leaves it half written
+        """
+        with self.lock, metrics.timer('cache.compact'):
+            temp_path = self.cache_path + '.tmp'
+            with open(temp_path, 'w') as file:
+                file.write(json.dumps(self.cached_data, indent=2))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.cache_path)
+            # the log is only removed after the new cache file is in place, replaying it again is harmless
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self.log_length = 0
@@ -0,0 +1,101 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: MembershipDistribution.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 6/10/23 13:17
+"""
+import numpy as np
+
+from MembershipIndex import read_member_list
+
+# lower bound in months of every tier bucket
+TIER_BUCKETS = (1, 2, 6, 12, 24, 36)
+
+
+def get_tier_labels(buckets=TIER_BUCKETS):
+    """
+    :param buckets: increasing lower bounds of the buckets in months
+    :return: list of bucket labels, e.g. '2-5' or '36+'
+    """
+    labels = []
+    for i, low in enumerate(buckets):
+        if i == len(buckets) - 1:
+            labels.append(f'{low}+')
+        elif buckets[i + 1] - 1 == low:
+            labels.append(str(low))
+        else:
+            labels.append(f'{low}-{buckets[i + 1] - 1}')
+    return labels
+
+
+def load_member_months(membership_file):
+    """
+    load the membership period of every member from the member master list
+    :param membership_file: path to the membership file
+    :return: numpy array of months
+    """
+    members, videos = read_member_list(membership_file)
+    return np.fromiter((entry['months'] for entry in members.values() if entry['months'] is not None),
+                       dtype=np.int64)
+
+
+class MembershipDistribution:
+    """
+    Distribution of membership lengths of a talent, used by both the plots and the revenue
+    """
+
+    def __init__(self, months, talent=None):
+        """
+        :param months: array of the membership period of every member in months
+        :param talent: name of the talent
+        """
+        self.talent = talent
+        self.months = np.asarray(months, dtype=np.int64)
+        self.lengths, self.counts = np.unique(self.months, return_counts=True)
+
+    @classmethod
+    def from_file(cls, membership_file, talent=None):
+        """
+        :param membership_file: path to the membership file
+        :param talent: name of the talent
+        :return: MembershipDistribution
+        """
+        return cls(load_member_months(membership_file), talent)
+
+    def get_member_count(self):
+        """
+        :return: number of unique members
+        """
+        return int(self.counts.sum())
+
+    def get_total_months(self):
+        """
+        :return: sum of the membership period of all members
+        """
+        return int(np.dot(self.lengths, self.counts))
+
+    def get_average_length(self):
+        """
+        :return: average membership period in months
+        """
+        return self.get_total_months() / self.get_member_count() if len(self.months) else 0.0
+
+    def get_revenue(self, price):
+        """
+        :param price: price of one month of membership
+        :return: total membership revenue
+        """
+        return self.get_total_months() * price
+
+    def get_tier_counts(self, buckets=TIER_BUCKETS):
+        """
+        count members by tier bucket
+        :param buckets: increasing lower bounds of the buckets in months
+        :return: list of bucket labels, numpy array of member counts
+        """
+        bucket_index = np.searchsorted(buckets, self.lengths, side='right') - 1
+        valid = bucket_index >= 0  # members below the first bucket are not counted
+        tier_counts = np.bincount(bucket_index[valid], weights=self.counts[valid], minlength=len(buckets))
+        return get_tier_labels(buckets), tier_counts.astype(np.int64)
@@ -0,0 +1,126 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: MembershipIndex.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 7/1/23 16:48
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+from Metrics import metrics
+
+
+def read_member_list(file_name):
+    """
+    read the member master list, the old {member id: months} format is converted
+    :param file_name: path of the member list
+    :return: {member id: {"months", "first_seen", "last_seen"}}, {video id: publish date} of merged videos
+    """
+    try:
+        with open(file_name, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}, {}
+    if 'members' in data and 'videos' in data:
+        return data['members'], data['videos']
+    # old format, there is no record of where the members were seen
+    return {member: {"months": months, "first_seen": None, "last_seen": None}
+            for member, months in data.items()}, {}
+
+
+class MembershipIndex:
+    """
+    Member master list loaded once and kept in RAM, saved as
+    {"videos": {video id: publish date}, "members": {member id: {"months", "first_seen", "last_seen"}}}.
+    first_seen and last_seen are [publish date, video id] of the first and last video the member chatted in.
+    The file is replaced atomically every flush_interval seconds and at exit.
+    """
+    FLUSH_INTERVAL = 60
+
+    def __init__(self, file_name, flush_interval=FLUSH_INTERVAL):
+        """
+        :param file_name: path of the member list
+        :param flush_interval: min seconds between two writes of the file
+        """
+        self.file_name = os.path.abspath(file_name)
+        self.flush_interval = flush_interval
+        self.members, self.videos = read_member_list(file_name)
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def has_video(self, vid):
+        """
+        check if the members of a video are merged and saved
+        :param vid: video id
+        :return: True if merged
+        """
+        return vid in self.videos
+
+    def merge(self, vid, video_date, member_dict_for_vid):
+        """
+        merge the members of a video, keep the longest membership period of every member
+        :param vid: video id
+        :param video_date: publish date YYYY-MM-DD of the video, used to order first and last seen,
+            '' if the video has no metadata, then first and last seen are left unchanged
+        :param member_dict_for_vid: {member id: months} of the video
+        """
+        seen = [video_date, vid] if video_date else None
+        with self.lock:
+            for member, months in member_dict_for_vid.items():
+                entry = self.members.get(member)
+                if entry is None:
+                    self.members[member] = {"months": months, "first_seen": seen, "last_seen": seen}
+                    continue
+                if months > entry['months']:
+                    entry['months'] = months
+                if seen is None:
+                    continue
+                if entry['first_seen'] is None or seen < entry['first_seen']:
+                    entry['first_seen'] = seen
+                if entry['last_seen'] is None or seen > entry['last_seen']:
+                    entry['last_seen'] = seen
+            self.videos[vid] = video_date
+            self.dirty = True
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        write the member list if it changed, the file is replaced atomically
+        """
+        with self.lock, metrics.timer('membership.flush'):
+            if not self.dirty:
+                return
+            temp_path = self.file_name + '.tmp'
+            with open(temp_path, 'w') as file:
+                file.write(json.dumps({"videos": self.videos, "members": self.members}, indent=2))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.file_name)
+            self.dirty = False
+            self.last_flush = time.monotonic()
+
+    def get_months(self):
+        """
+        :return: {member id: months}
+        """
+        return {member: entry['months'] for member, entry in self.members.items()}
+
+    def get_churn_by_month(self):
+        """
+        count the members by the month of the last video they were seen in
+        :return: {YYYYMM: number of members}
+        """
+        churn = {}
+        for entry in self.members.values():
+            if entry['last_seen'] is not None and entry['last_seen'][0]:
+                month = entry['last_seen'][0][:7].replace('-', '')
+                churn[month] = churn.get(month, 0) + 1
+        return churn
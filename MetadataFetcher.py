@@ -0,0 +1,125 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: MetadataFetcher.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 6/24/23 12:05
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import backoff
+
+from Metrics import metrics
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by threads, a request can be made when a token is available
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: tokens added per second
+        :param capacity: max number of tokens saved for a burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        take a token, wait until one is available
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+                self.last_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class PytubeMetadataProvider:
+    """
+    get the metadata of a video from YouTube with pytube
+    """
+
+    def __init__(self):
+        import pytube
+        self.RETRY_EXCEPTIONS = (pytube.exceptions.PytubeError, ValueError)
+
+    def get_metadata(self, url):
+        """
+        :param url: url of the video
+        :return: dict of title, publish_date, views and duration
+        """
+        from pytube import YouTube
+        yt = YouTube(url)
+        return {
+            'title': yt.title,
+            'publish_date': yt.publish_date.strftime('%Y-%m-%d'),
+            'views': yt.views,
+            'duration': yt.length
+        }
+
+
+class MetadataFetcher:
+    """
+    Fetch the metadata of many videos with a few threads under one rate limit,
+    every video is retried on its own and written to the cache as soon as it is fetched
+    """
+
+    def __init__(self, cache, provider=None, rate=1 / 3, workers=2, max_time=60):
+        """
+        :param cache: LocalCache of metadata keyed by url
+        :param provider: object with get_metadata(url) and RETRY_EXCEPTIONS, pytube by default
+        :param rate: max number of requests per second
+        :param workers: number of threads
+        :param max_time: max seconds spent retrying a video
+        """
+        self.cache = cache
+        self.provider = provider if provider is not None else PytubeMetadataProvider()
+        self.rate_limiter = TokenBucket(rate)
+        self.workers = workers
+        self.fetch = backoff.on_exception(backoff.expo, self.provider.RETRY_EXCEPTIONS,
+                                          max_time=max_time)(self.fetch_once)
+
+    def fetch_once(self, url):
+        """
+        fetch the metadata of a video once the rate limit allows and cache it
+        :param url: url of the video
+        :return: metadata dict
+        """
+        self.rate_limiter.acquire()
+        with metrics.timer('api.metadata'):
+            metadata = self.provider.get_metadata(url)
+        self.cache.set_local_cache(url, metadata)
+        self.cache.flush()
+        return metadata
+
+    def fetch_all(self, urls):
+        """
+        get the metadata of all videos, from the cache if possible
+        :param urls: list of video urls
+        :return: dict of url: metadata in the order of urls, videos that kept failing are left out
+        """
+        metadata_all = {}
+        todo_urls = [url for url in urls if not self.cache.is_in_cache(url)]
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = dict(zip(todo_urls, [executor.submit(self.fetch, url) for url in todo_urls]))
+            for url in urls:
+                if url in futures:
+                    try:
+                        metadata_all[url] = futures[url].result()
+                    except self.provider.RETRY_EXCEPTIONS as e:
+                        print(f'metadata failed, URL {url}: {e}')
+                else:
+                    metadata_all[url] = self.cache.get_local_cache(url)
+        return metadata_all
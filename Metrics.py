@@ -0,0 +1,299 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: Metrics.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 7/22/23 10:15
+"""
+import atexit
+import cProfile
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+
+
+class NullTimer:
+    """
+    timer used when metrics are disabled, does nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    """
+    measure the time of a with block and add it to the metrics
+    """
+
+    def __init__(self, metrics, name, profile_file=None):
+        self.metrics = metrics
+        self.name = name
+        self.profile_file = profile_file
+        self.profiler = None
+        self.start = None
+
+    def __enter__(self):
+        if self.profile_file is not None:
+            for file_name in glob.glob(get_worker_prefix(self.profile_file) + '*.prof'):
+                os.remove(file_name)  # left by an interrupted run
+            self.metrics.profile_owners[self.profile_file] = (os.getpid(), threading.get_ident())
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                self.profiler = None  # another profiler is already running
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if self.profile_file is not None:
+            if self.profiler is not None:
+                self.profiler.disable()
+            self.metrics.profile_owners.pop(self.profile_file, None)
+            # merge the tasks that ran in worker threads and processes, see WorkerProfile
+            stats = pstats.Stats(self.profiler) if self.profiler is not None else pstats.Stats()
+            for file_name in glob.glob(get_worker_prefix(self.profile_file) + '*.prof'):
+                stats.add(file_name)
+                os.remove(file_name)
+            stats.dump_stats(self.profile_file)
+        self.metrics.add_time(self.name, seconds)
+        return False
+
+
+def get_worker_prefix(profile_file):
+    """
+    :param profile_file: .prof file of a stage
+    :return: start of the names of the .prof files of its worker tasks
+    """
+    return profile_file[:-len('.prof')] + '.worker-'
+
+
+class WorkerProfile:
+    """
+    profile a task of a stage that runs in a worker thread or process, a stage only profiles its own thread.
+    the stats of every task are dumped to a file that the stage merges into its .prof file when it ends
+    """
+    task_ids = itertools.count()
+
+    def __init__(self, profile_file):
+        self.profile_file = profile_file
+        self.profiler = None
+
+    def __enter__(self):
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            self.profiler = None  # another profiler is already running
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(f'{get_worker_prefix(self.profile_file)}{os.getpid()}-'
+                                     f'{threading.get_ident()}-{next(self.task_ids)}.prof')
+        return False
+
+
+class WorkerMetrics:
+    """
+    collect the counters and timers of a task that runs in a worker process, they would be lost with the process.
+    the task returns data with its result and the main process adds it with Metrics.merge
+    """
+
+    def __init__(self, metrics, active):
+        self.metrics = metrics
+        self.active = active
+        self.data = None
+
+    def __enter__(self):
+        if self.active:
+            self.metrics.take()  # inherited from the main process when the worker was forked
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.active:
+            self.data = self.metrics.take()
+        return False
+
+
+class Metrics:
+    """
+    Counters and timers of the hot paths, disabled by default so they cost almost nothing.
+    When enabled, events are written as json lines and a summary is printed and written at exit.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.timers = {}  # name -> [count, total seconds, max seconds]
+        self.events_file = None
+        self.profile_stages = set()
+        self.profile_path = 'profiles/'
+        self.profile_owners = {}  # .prof file of a running stage -> (process id, thread id) of the stage
+        self.lock = threading.Lock()
+
+    def enable(self, events_file=None, profile_stages=(), profile_path='profiles/'):
+        """
+        start collecting metrics
+        :param events_file: json lines file for the events and the summary, nothing is written if None
+        :param profile_stages: names of the stages to run under cProfile
+        :param profile_path: folder of the .prof files of the profiled stages
+        """
+        self.enabled = True
+        self.events_file = os.path.abspath(events_file) if events_file else None
+        self.profile_stages = set(profile_stages)
+        self.profile_path = os.path.join(os.path.abspath(profile_path), '')
+        if self.profile_stages:
+            os.makedirs(profile_path, exist_ok=True)
+        atexit.register(self.report)
+
+    def count(self, name, value=1):
+        """
+        add to a counter
+        :param name: name of the counter
+        :param value: amount to add
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        """
+        add a measured time to a timer
+        :param name: name of the timer
+        :param seconds: time in seconds
+        """
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def timer(self, name):
+        """
+        time a with block
+        :param name: name of the timer
+        :return: context manager
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def stage(self, name):
+        """
+        time a stage of a run, the stage is profiled with cProfile if it is in profile_stages
+        :param name: name of the stage
+        :return: context manager
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        profile_file = f'{self.profile_path}{name}.prof' if name in self.profile_stages else None
+        return Timer(self, f'stage.{name}', profile_file)
+
+    def profile_worker(self, name):
+        """
+        profile a task of a stage that runs in a worker thread or process, merged into the profile of the stage.
+        nothing is done in the thread of the stage itself, it is already profiled
+        :param name: name of the stage
+        :return: context manager
+        """
+        if not self.enabled or name not in self.profile_stages:
+            return NULL_TIMER
+        profile_file = f'{self.profile_path}{name}.prof'
+        if self.profile_owners.get(profile_file) == (os.getpid(), threading.get_ident()):
+            return NULL_TIMER
+        return WorkerProfile(profile_file)
+
+    def worker_task(self):
+        """
+        collect the counters and timers of a task in a worker process, see WorkerMetrics.
+        in the main process they are recorded as usual and the data of the context manager is None
+        :return: context manager
+        """
+        return WorkerMetrics(self, self.enabled and multiprocessing.parent_process() is not None)
+
+    def take(self):
+        """
+        remove the counters and timers recorded so far
+        :return: dict {"counters": {name: value}, "timers": {name: [count, total seconds, max seconds]}}
+        """
+        with self.lock:
+            data = {'counters': self.counters, 'timers': self.timers}
+            self.counters = {}
+            self.timers = {}
+        return data
+
+    def merge(self, data):
+        """
+        add the counters and timers of a task that ran in a worker process
+        :param data: dict returned by take, nothing is done if None
+        """
+        if data is None:
+            return
+        with self.lock:
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, (count, total, longest) in data['timers'].items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], longest)
+
+    def event(self, name, **fields):
+        """
+        write an event as a json line
+        :param name: name of the event
+        :param fields: values of the event
+        """
+        if not self.enabled or self.events_file is None:
+            return
+        line = json.dumps({'event': name, 'time': time.time(), **fields})
+        with self.lock:
+            with open(self.events_file, 'a') as f:
+                f.write(line + '\n')
+
+    def get_summary(self):
+        """
+        :return: dict of counters and timers
+        """
+        with self.lock:
+            timers = {name: {'count': count, 'total_seconds': round(total, 6), 'max_seconds': round(longest, 6),
+                             'mean_seconds': round(total / count, 6)}
+                      for name, (count, total, longest) in self.timers.items()}
+            return {'counters': dict(self.counters), 'timers': timers}
+
+    def report(self):
+        """
+        print the summary and write it to the events file
+        """
+        summary = self.get_summary()
+        self.event('summary', **summary)
+        print('Metrics summary:')
+        for name, value in sorted(summary['counters'].items()):
+            print(f'  {name}: {value}')
+        for name, timer in sorted(summary['timers'].items()):
+            print(f"  {name}: {timer['count']} x, total {timer['total_seconds']:.3f} s, "
+                  f"max {timer['max_seconds']:.3f} s")
+
+
+metrics = Metrics()
+# enable from the environment, e.g. VTUBER_METRICS=metrics.jsonl VTUBER_PROFILE=analysis.load
+if os.environ.get('VTUBER_METRICS'):
+    metrics.enable(os.environ['VTUBER_METRICS'],
+                   [stage for stage in os.environ.get('VTUBER_PROFILE', '').split(',') if stage])
@@ -0,0 +1,183 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: PaidChatColumns.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 5/27/23 16:24
+"""
+import json
+import os
+import numpy as np
+
+from ChatArchive import get_archive, is_archived
+from MembershipDistribution import TIER_BUCKETS
+from Metrics import metrics
+from WordFrequency import WordFrequency
+
+# Columnar storage of the paid messages of a video, one .npz file per video with the arrays
+#     time:       float64, time_in_seconds of the message
+#     amount:     float64, amount of money
+#     currency:   int32, index into currencies
+#     currencies: str, currency symbols or codes used in this video
+#     membership: int16, membership period of the author in months, 0 if not a member
+#     msg_offset: int64, message i is text[msg_offset[i]:msg_offset[i + 1]], length is number of messages + 1
+#     text:       uint8, utf-8 bytes of all the messages
+#     metadata:   str, json of the video metadata
+
+
+def get_file_signature(file_name):
+    """
+    get a signature that changes when the file is rewritten
+    :param file_name: path of the file, or <chat path><video id>.jsonl of a video in the archive
+    :return: [modified time in ns, size], [offset, length] of the member for an archived video
+    """
+    if is_archived(file_name):
+        archive, vid = get_archive(file_name)
+        return archive.get_signature(vid)
+    stat = os.stat(file_name)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def messages_to_columns(messages):
+    """
+    turn paid messages in the json export format into columns
+    :param messages: list of {"time", "money", "msg", "membership"}
+    :return: dict of numpy arrays
+    """
+    currencies = {}
+    currency = np.empty(len(messages), dtype=np.int32)
+    texts = []
+    for i, msg_data in enumerate(messages):
+        currency[i] = currencies.setdefault(msg_data['money']['currency'], len(currencies))
+        texts.append((msg_data['msg'] or '').encode('utf-8'))
+    msg_offset = np.zeros(len(messages) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(text) for text in texts], dtype=np.int64), out=msg_offset[1:])
+    return {'time': np.array([msg_data['time'] for msg_data in messages], dtype=np.float64),
+            'amount': np.array([msg_data['money']['amount'] for msg_data in messages], dtype=np.float64),
+            'currency': currency,
+            'currencies': np.array(list(currencies), dtype=str),
+            # older exports have null for badges without a parsable period, counted as non-members
+            'membership': np.array([msg_data['membership'] or 0 for msg_data in messages], dtype=np.int16),
+            'msg_offset': msg_offset,
+            'text': np.frombuffer(b''.join(texts), dtype=np.uint8)}
+
+
+def write_paid_chat_columns(file_name, messages, metadata):
+    """
+    write the paid messages of a video to a .npz file
+    :param file_name: path of the .npz file
+    :param messages: list of {"time", "money", "msg", "membership"}
+    :param metadata: metadata of the video
+    """
+    columns = messages_to_columns(messages)
+    with open(file_name, 'wb') as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata)), **columns)
+
+
+def read_paid_chat_columns(file_name):
+    """
+    read the paid messages of a video from a .npz file
+    :param file_name: path of the .npz file
+    :return: metadata dict, dict of numpy arrays
+    """
+    with np.load(file_name) as data:
+        columns = {key: data[key] for key in data.files}
+    metadata = json.loads(str(columns.pop('metadata')))
+    return metadata, columns
+
+
+def read_paid_chat_json(file_name):
+    """
+    read the paid messages of a video from a json export of ChatDownload
+    :param file_name: path of the .json file
+    :return: metadata dict, dict of numpy arrays
+    """
+    with open(file_name, 'r') as f:
+        chat_data = json.load(f)
+    metadata = chat_data.pop('metadata')
+    return metadata, messages_to_columns(list(chat_data.values()))
+
+
+def read_paid_chat(file_name):
+    """
+    read the paid messages of a video in any format
+    :param file_name: path of a .npz or .json file, or <chat path><video id>.jsonl of a video in the archive
+    :return: metadata dict, dict of numpy arrays
+    """
+    if is_archived(file_name):
+        archive, vid = get_archive(file_name)
+        metadata, messages = archive.read(vid)
+        return metadata, messages_to_columns(messages)
+    if file_name.endswith('.npz'):
+        with metrics.timer('chat.read.npz'):
+            return read_paid_chat_columns(file_name)
+    with metrics.timer('chat.read.json'):
+        return read_paid_chat_json(file_name)
+
+
+def get_texts(columns):
+    """
+    get the text of every message
+    :param columns: dict of numpy arrays
+    :return: generator of strings, empty string for messages without text
+    """
+    text = columns['text'].tobytes()
+    msg_offset = columns['msg_offset']
+    for i in range(len(msg_offset) - 1):
+        yield text[msg_offset[i]:msg_offset[i + 1]].decode('utf-8')
+
+
+def summarize_paid_chat(file_name, count_words=True):
+    """
+    pre-aggregate the paid messages of a video, runs in the worker processes of ChatAnalysis.
+    amounts are summed by currency and converted to usd by the caller, so no exchange rate is needed here
+    :param file_name: path of a .npz or .json file
+    :param count_words: count the words of the messages, skip it if the counts are cached
+    :return: dict of publish date, month key YYYYMM, duration, currencies, sum of amounts by currency,
+        cells of (currency index, membership bucket, messages, amount) and word counts.
+        membership bucket 0 is non-members, bucket i is TIER_BUCKETS[i - 1]
+    """
+    metadata, columns = read_paid_chat(file_name)
+    currency_count = len(columns['currencies'])
+    amounts = np.bincount(columns['currency'], weights=columns['amount'], minlength=currency_count)
+    # sum by currency and membership bucket at once with a combined key
+    bucket_count = len(TIER_BUCKETS) + 1
+    buckets = np.searchsorted(TIER_BUCKETS, columns['membership'], side='right')
+    cell_key = columns['currency'].astype(np.int64) * bucket_count + buckets
+    cell_messages = np.bincount(cell_key, minlength=currency_count * bucket_count)
+    cell_amounts = np.bincount(cell_key, weights=columns['amount'], minlength=currency_count * bucket_count)
+    cell_index = np.flatnonzero(cell_messages)
+    words = None
+    if count_words:
+        word_frequency = WordFrequency()
+        for msg in get_texts(columns):
+            word_frequency.add_message(msg)
+        words = dict(word_frequency.counts)
+    return {'publish_date': metadata['publish_date'],
+            'month': metadata['publish_date'][:7].replace('-', ''),
+            'currencies': columns['currencies'].tolist(),
+            'amounts': amounts.tolist(),
+            'duration': metadata.get('duration'),
+            'cells': [[int(key // bucket_count), int(key % bucket_count), int(cell_messages[key]),
+                       float(cell_amounts[key])] for key in cell_index],
+            'words': words}
+
+
+def convert_chat_dir(chat_path='chats/'):
+    """
+    convert all the json exports in a chat folder to .npz files, the json files are kept
+    :param chat_path: path to the chat folder
+    """
+    file_list = [video for video in os.listdir(chat_path) if video.endswith('.json')]
+    for count, video in enumerate(file_list, 1):
+        with open(chat_path + video, 'r') as f:
+            chat_data = json.load(f)
+        metadata = chat_data.pop('metadata')
+        write_paid_chat_columns(chat_path + video[:-len('.json')] + '.npz', list(chat_data.values()), metadata)
+        print('\r', 'Converting: ', count, '/', len(file_list), end='')
+    print('')
+
+
+if __name__ == '__main__':
+    convert_chat_dir()
@@ -0,0 +1,122 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: Plots.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 8/5/23 14:20
+"""
+import matplotlib.pyplot as plt
+
+
+def plot_income_by_video(income_by_video):
+    """
+    plot the income by video
+    :param income_by_video: {video sequence id: income in usd}
+    :return: the figure
+    """
+    sorted_data = {k: v for k, v in sorted(income_by_video.items())}
+    fig = plt.figure(figsize=(18, 11))
+    plt.plot(sorted_data.keys(), sorted_data.values(), 'o-', color='#960019')
+    plt.xticks([])
+    plt.yticks(size=16)
+    plt.title('Income by video in USD', size=24)
+    plt.xlabel('Video', size=20)
+    plt.ylabel('Income in USD', size=20)
+    return fig
+
+
+def plot_income_by_month(income_by_month):
+    """
+    plot the income by month
+    :param income_by_month: {YYYYMM: income in usd}
+    :return: the figure
+    """
+    sorted_data = {k: v for k, v in sorted(income_by_month.items())}
+    fig = plt.figure(figsize=(16, 11))
+    plt.plot(sorted_data.keys(), sorted_data.values(), 's-', color='#960019')
+    plt.xticks(rotation=45, size=16)
+    plt.yticks(size=16)
+    plt.title('Income by month in USD', size=24)
+    plt.xlabel('Month', size=20)
+    plt.ylabel('Income in USD', size=20)
+    return fig
+
+
+def plot_income_by_currency(income_usd_by_currency):
+    """
+    plot the income by currency
+    :param income_usd_by_currency: {currency: income in usd}
+    :return: the figure
+    """
+    sorted_data = {k: v for k, v in sorted(income_usd_by_currency.items(), key=lambda x: x[1], reverse=True)}
+    fig = plt.figure(figsize=(16, 11))
+    plt.bar(sorted_data.keys(), sorted_data.values(), color='#960019')
+    plt.xticks(rotation=45, size=12)
+    plt.yticks(size=16)
+    plt.title('Income by currency in USD', size=24)
+    plt.xlabel('Currency', size=20)
+    plt.ylabel('Income in USD', size=20)
+    return fig
+
+
+def plot_word_cloud(word_counts):
+    """
+    plot the word cloud of the chat
+    :param word_counts: {word: count}
+    :return: the figure
+    """
+    from wordcloud import WordCloud
+    # Create the word cloud
+    wordcloud = WordCloud(width=1600, height=800, background_color='white').generate_from_frequencies(word_counts)
+    # Display the word cloud
+    fig = plt.figure(figsize=(16, 9))
+    plt.imshow(wordcloud, interpolation='bilinear')
+    plt.axis('off')
+    return fig
+
+
+def plot_membership_distribution(distribution):
+    """
+    plot a bar plot of the membership length
+    :param distribution: {"lengths": membership lengths in months, "counts": number of members of every length}
+    :return: the figure
+    """
+    fig = plt.figure()
+    plt.bar([str(length) for length in distribution['lengths']], distribution['counts'], color='#960019')
+    # add bar height to the bar plot
+    for i, v in enumerate(distribution['counts']):
+        plt.text(i, v + 0.5, str(v), ha='center', fontweight='bold')
+    plt.xlabel('Membership Length (Months)')
+    plt.ylabel('Number of Members')
+    plt.title('Membership Length Distribution')
+    return fig
+
+
+def plot_income_over_stream(income_over_stream):
+    """
+    plot the average share of the income earned until every point of a stream
+    :param income_over_stream: {"progress": fractions of the duration, "share": share of the income}
+    :return: the figure
+    """
+    fig = plt.figure(figsize=(16, 11))
+    plt.plot([100 * p for p in income_over_stream['progress']], [100 * s for s in income_over_stream['share']],
+             '-', color='#960019')
+    plt.plot([0, 100], [0, 100], '--', color='grey')  # income earned evenly over the stream
+    plt.xticks(size=16)
+    plt.yticks(size=16)
+    plt.title('Share of the income earned over the stream', size=24)
+    plt.xlabel('Progress of the stream in %', size=20)
+    plt.ylabel('Share of the income in %', size=20)
+    return fig
+
+
+# figure name -> (plot function, title in the report)
+FIGURES = {
+    'income_by_currency': (plot_income_by_currency, 'Income by currency'),
+    'income_by_month': (plot_income_by_month, 'Income by month'),
+    'income_by_video': (plot_income_by_video, 'Income by video'),
+    'word_cloud': (plot_word_cloud, 'Key word cloud from all paid messages'),
+    'membership_distribution': (plot_membership_distribution, 'Membership length distribution'),
+    'income_over_stream': (plot_income_over_stream, 'Share of the income earned over the stream'),
+}
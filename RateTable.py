@@ -0,0 +1,134 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: RateTable.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 5/20/23 11:36
+"""
+import bisect
+import json
+from datetime import date, timedelta
+from LocalCache import LocalCache
+from Metrics import metrics
+
+
+class ExchangeRateHostSource:
+    """
+    get USD based exchange rates of all currencies from exchangerate.host, many days in one request
+    """
+    URL = 'https://api.exchangerate.host/timeseries'
+    MAX_DAYS = 365
+
+    def __init__(self, http=None):
+        """
+        :param http: object with get(url, params) like requests, requests if None, see Replay.ReplayHttp
+        """
+        self.http = http
+
+    def get_rates(self, start_date, end_date):
+        """
+        get the rates of all currencies for every day between start_date and end_date
+        :param start_date: YYYY-MM-DD
+        :param end_date: YYYY-MM-DD, at most MAX_DAYS after start_date
+        :return: {YYYY-MM-DD: {currency: units of currency per USD}}
+        """
+        if self.http is None:
+            import requests
+            self.http = requests
+        response = self.http.get(self.URL, params={'start_date': start_date, 'end_date': end_date, 'base': 'USD'})
+        data = response.json()
+        return data['rates']
+
+
+class StaticRateSource:
+    """
+    serve exchange rates from a local json file {YYYY-MM-DD: {currency: units of currency per USD}},
+    used to run everything offline
+    """
+    MAX_DAYS = 365
+
+    def __init__(self, rate_file):
+        """
+        :param rate_file: path to the json file of rates
+        """
+        with open(rate_file, 'r') as f:
+            self.rates = json.load(f)
+
+    def get_rates(self, start_date, end_date):
+        """
+        get the rates of all currencies for every day between start_date and end_date
+        :param start_date: YYYY-MM-DD
+        :param end_date: YYYY-MM-DD
+        :return: {YYYY-MM-DD: {currency: units of currency per USD}}
+        """
+        return {day: rates for day, rates in self.rates.items() if start_date <= day <= end_date}
+
+
+class RateTable:
+    """
+    Table of USD based exchange rates by day and currency, kept in RAM and cached in a local file.
+    A missing day is filled together with the days around it in one request to the source.
+    """
+    LOCAL_CACHE = 'cached_rate_table.json'
+    LOOKBACK_DAYS = 7
+
+    def __init__(self, source=None, cache_file=LOCAL_CACHE):
+        """
+        :param source: object with get_rates(start_date, end_date) and MAX_DAYS, exchangerate.host by default
+        :param cache_file: path to the local cache file
+        """
+        self.source = source if source is not None else ExchangeRateHostSource()
+        self.cache = LocalCache(cache_file)
+        self.rates = dict(self.cache.cached_data)
+        self.sorted_days = sorted(self.rates)
+
+    def fetch(self, day):
+        """
+        get the rates of a day, a few days before it and the days after it from the source, cache them
+        :param day: YYYY-MM-DD
+        """
+        start_date = date.fromisoformat(day) - timedelta(days=self.LOOKBACK_DAYS)
+        end_date = min(start_date + timedelta(days=self.source.MAX_DAYS - 1), date.today())
+        with metrics.timer('api.rates'):
+            new_rates = self.source.get_rates(start_date.strftime('%Y-%m-%d'),
+                                              max(start_date, end_date).strftime('%Y-%m-%d'))
+        print(f'[API] rates of {len(new_rates)} days around {day}')
+        for new_day, rates in new_rates.items():
+            if new_day not in self.rates:
+                self.rates[new_day] = rates
+                self.cache.set_local_cache(new_day, rates)
+        self.cache.flush()
+        self.sorted_days = sorted(self.rates)
+
+    def get_rates_of_day(self, day=None):
+        """
+        get the rates of all currencies of a day
+        :param day: YYYY-MM-DD, today if None
+        :return: {currency: units of currency per USD}
+        """
+        if day is None:
+            day = date.today().strftime('%Y-%m-%d')
+        if day in self.rates:
+            metrics.count('rates.hit')
+        else:
+            metrics.count('rates.miss')
+            self.fetch(day)
+            if day not in self.rates:
+                # the source has no rate of this day (e.g. a holiday), use the closest earlier day
+                index = bisect.bisect_right(self.sorted_days, day)
+                if index == 0:
+                    raise KeyError(f'no exchange rate on or before {day}')
+                self.rates[day] = self.rates[self.sorted_days[index - 1]]
+        return self.rates[day]
+
+    def get_rate(self, from_currency, to_currency, day=None):
+        """
+        get exchange rate of two currencies on a day
+        :param from_currency:
+        :param to_currency:
+        :param day: YYYY-MM-DD, today if None
+        :return: exchange rate of two currencies
+        """
+        rates = self.get_rates_of_day(day)
+        return rates[to_currency] / rates[from_currency]
@@ -0,0 +1,267 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: Replay.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 9/9/23 10:41
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from Metrics import metrics
+
+
+class ReplayMissingError(Exception):
+    """
+    raised in replay mode when nothing was recorded for a request
+    """
+
+
+class ReplayStore:
+    """
+    Gzip files of recorded responses, one file per request, so the download and the analysis run without network.
+    mode 'record' always calls the real source and saves the response, 'replay' only reads the files,
+    'auto' replays what was recorded and records the rest.
+    latency is slept before every replayed request to simulate the network, 0 replays at full speed.
+    """
+    MODES = ('record', 'replay', 'auto')
+
+    def __init__(self, path='replay/', mode='auto', latency=0.0):
+        """
+        :param path: folder of the recordings
+        :param mode: 'record', 'replay' or 'auto'
+        :param latency: seconds slept before every replayed request
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'unknown replay mode {mode}, use one of {self.MODES}')
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        os.makedirs(path, exist_ok=True)
+
+    def get_file(self, kind, key):
+        """
+        :param kind: kind of request, e.g. 'chat'
+        :param key: what identifies the request, e.g. the url
+        :return: path of the recording
+        """
+        return f'{self.path}{kind}_{hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]}.jsonl.gz'
+
+    def should_replay(self, kind, key):
+        """
+        :return: True if the request is answered from a recording
+        """
+        if self.mode == 'replay':
+            if not os.path.exists(self.get_file(kind, key)):
+                raise ReplayMissingError(f'no recording of {kind} {key} in {self.path}')
+            return True
+        return self.mode == 'auto' and os.path.exists(self.get_file(kind, key))
+
+    def wait(self):
+        """
+        simulate the network latency of a request
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+    def write_lines(self, kind, key, lines):
+        """
+        record an iterable of json values, the file only appears once all of them are written
+        :param kind: kind of request
+        :param key: what identifies the request
+        :param lines: iterable of json serializable values
+        :return: generator of the values, recorded while they are iterated
+        """
+        file_name = self.get_file(kind, key)
+        temp_path = file_name + '.tmp'
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+                for line in lines:
+                    f.write(json.dumps(line) + '\n')
+                    yield line
+            os.replace(temp_path, file_name)
+            metrics.count(f'replay.{kind}.recorded')
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)  # the iteration failed or stopped early
+
+    def read_lines(self, kind, key):
+        """
+        :param kind: kind of request
+        :param key: what identifies the request
+        :return: generator of the recorded json values
+        """
+        metrics.count(f'replay.{kind}.replayed')
+        with gzip.open(self.get_file(kind, key), 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def call(self, kind, key, function):
+        """
+        answer a request with a single response from the recording, or call the function and record it
+        :param kind: kind of request
+        :param key: what identifies the request
+        :param function: function without arguments that makes the real request
+        :return: json serializable response
+        """
+        if self.should_replay(kind, key):
+            self.wait()
+            return next(self.read_lines(kind, key))
+        value = function()
+        for _ in self.write_lines(kind, key, [value]):
+            pass
+        return value
+
+
+class ReplayChatSource:
+    """
+    Record and replay the message stream of ChatDownloader().get_chat.
+    A recording starts with a header {"url", "message_types"}, then one message per line. An error of
+    chat_downloader that ends the stream (e.g. no chat replay) is recorded as the last line and raised again,
+    except RetriesExceeded which is a network problem.
+    """
+    PAGE_SIZE = 100  # messages per simulated request when replaying with latency
+
+    def __init__(self, store, source=None):
+        """
+        :param store: ReplayStore
+        :param source: object with get_chat(url, start_time, message_types), ChatDownloader if None
+        """
+        if source is None:
+            from ChatDownload import ChatDownloaderSource
+            source = ChatDownloaderSource()
+        self.store = store
+        self.source = source
+
+    def get_chat(self, url, start_time=None, message_types=None):
+        """
+        :param url: url of the video
+        :param start_time: skip the messages before this time in seconds
+        :param message_types: message types to get, all recorded types if None
+        :return: iterable of message dicts
+        """
+        if self.store.should_replay('chat', url):
+            return self.replay(url, start_time, message_types)
+        return self.record(url, message_types)
+
+    @staticmethod
+    def get_error(line):
+        """
+        :param line: a line of a recording
+        :return: the recorded chat_downloader error, None if the line is a message
+        """
+        if 'error' not in line or 'message_id' in line:
+            return None
+        import chat_downloader.errors
+        return getattr(chat_downloader.errors, line['error'], chat_downloader.errors.ChatDownloaderError)(
+            line['message'])
+
+    def download(self, url, message_types):
+        """
+        the lines of a recording: the header, the messages and the error that ended the chat if any
+        """
+        import chat_downloader.errors
+        yield {'url': url, 'message_types': message_types}
+        try:
+            for message in self.source.get_chat(url, message_types=message_types):
+                yield message
+        except chat_downloader.errors.RetriesExceeded:
+            raise  # nothing is recorded, the next run tries again
+        except chat_downloader.errors.ChatDownloaderError as e:
+            yield {'error': type(e).__name__, 'message': str(e)}
+
+    def record(self, url, message_types):
+        # the whole chat is recorded, when a download is resumed the messages before the checkpoint are skipped
+        # by ChatDownload.record_chat
+        lines = self.store.write_lines('chat', url, self.download(url, message_types))
+        next(lines)  # header
+        for line in lines:
+            error = self.get_error(line)
+            if error is not None:
+                for _ in lines:
+                    pass  # finish writing the recording before raising
+                raise error
+            yield line
+
+    def replay(self, url, start_time, message_types):
+        lines = self.store.read_lines('chat', url)
+        header = next(lines)
+        if message_types is not None and header['message_types'] is not None:
+            missing = set(message_types) - set(header['message_types'])
+            if missing:
+                raise ReplayMissingError(f'the recording of {url} has no {sorted(missing)} messages')
+        wanted = set(message_types) if message_types is not None else None
+        self.store.wait()
+        for count, line in enumerate(lines, 1):
+            error = self.get_error(line)
+            if error is not None:
+                raise error
+            if count % self.PAGE_SIZE == 0:
+                self.store.wait()
+            if start_time is not None and line['time_in_seconds'] < start_time:
+                continue
+            if wanted is None or line.get('message_type') in wanted:
+                yield line
+
+
+class ReplayMetadataProvider:
+    """
+    Record and replay the video metadata of a provider of MetadataFetcher, pytube by default
+    """
+
+    def __init__(self, store, provider=None):
+        """
+        :param store: ReplayStore
+        :param provider: object with get_metadata(url) and RETRY_EXCEPTIONS, pytube if None and recording
+        """
+        self.store = store
+        if provider is None and store.mode != 'replay':
+            from MetadataFetcher import PytubeMetadataProvider
+            provider = PytubeMetadataProvider()
+        self.provider = provider
+        self.RETRY_EXCEPTIONS = provider.RETRY_EXCEPTIONS if provider is not None else ()
+
+    def get_metadata(self, url):
+        return self.store.call('metadata', url, lambda: self.provider.get_metadata(url))
+
+
+class ReplayResponse:
+    """
+    the part of requests.Response used by the exchange rate code
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class ReplayHttp:
+    """
+    Record and replay the json responses of requests.get
+    """
+
+    def __init__(self, store):
+        """
+        :param store: ReplayStore
+        """
+        self.store = store
+
+    def get(self, url, params=None):
+        """
+        :param url: url of the request
+        :param params: query parameters
+        :return: ReplayResponse
+        """
+        key = url + '?' + json.dumps(params, sort_keys=True)
+
+        def request():
+            import requests
+            return requests.get(url, params=params).json()
+
+        return ReplayResponse(self.store.call('http', key, request))
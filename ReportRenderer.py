@@ -0,0 +1,141 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: ReportRenderer.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 8/5/23 15:02
+"""
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from LocalCache import LocalCache
+from Metrics import metrics
+
+
+def get_data_hash(data):
+    """
+    :param data: json serializable input data of a figure
+    :return: sha256 hex digest of the data
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_figure(name, data, file_base, formats):
+    """
+    draw a figure off-screen and save it, runs in a worker process so the backend of the caller is not changed
+    :param name: name of the figure in Plots.FIGURES
+    :param data: input data of the plot function
+    :param file_base: path of the output files without extension
+    :param formats: file formats, e.g. ('png', 'svg')
+    :return: name of the figure
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from Plots import FIGURES
+    fig = FIGURES[name][0](data)
+    for file_format in formats:
+        fig.savefig(f'{file_base}.{file_format}', format=file_format, bbox_inches='tight')
+    plt.close(fig)
+    return name
+
+
+class ReportRenderer:
+    """
+    Render all figures of an analysis without a display and write a summary page with the numbers.
+    A figure is only drawn again when the hash of its input data changed or a file of it is missing.
+    """
+    HASH_CACHE = 'figure_hashes.json'
+
+    def __init__(self, output_path='report/', formats=('png', 'svg'), workers=2):
+        """
+        :param output_path: folder of the figures and the summary
+        :param formats: file formats of the figures
+        :param workers: number of processes that draw the figures
+        """
+        self.output_path = output_path
+        self.formats = tuple(formats)
+        self.workers = workers
+        os.makedirs(output_path, exist_ok=True)
+        self.hash_cache = LocalCache(output_path + self.HASH_CACHE)
+
+    def is_up_to_date(self, name, data_hash):
+        """
+        check if the files of a figure were drawn from the same data
+        :param name: name of the figure
+        :param data_hash: hash of the input data
+        :return: True if the figure can be skipped
+        """
+        if not self.hash_cache.is_in_cache(name) or self.hash_cache.get_local_cache(name) != data_hash:
+            return False
+        return all(os.path.exists(f'{self.output_path}{name}.{file_format}') for file_format in self.formats)
+
+    def render_figures(self, figure_data):
+        """
+        draw the figures whose data changed
+        :param figure_data: {figure name: input data}
+        :return: list of the names of the figures drawn
+        """
+        hashes = {name: get_data_hash(data) for name, data in figure_data.items()}
+        todo = [name for name in figure_data if not self.is_up_to_date(name, hashes[name])]
+        metrics.count('report.figures.skipped', len(figure_data) - len(todo))
+        file_bases = [self.output_path + name for name in todo]
+        done = []
+        with metrics.stage('report.render'):
+            if todo:
+                # always drawn in worker processes, even one at a time: render_figure switches matplotlib to
+                # the Agg backend, which would stop the caller from showing its plots afterwards
+                with ProcessPoolExecutor(max_workers=max(1, min(self.workers, len(todo)))) as executor:
+                    done = list(executor.map(render_figure, todo, [figure_data[name] for name in todo],
+                                             file_bases, [self.formats] * len(todo)))
+        for name in done:
+            self.hash_cache.set_local_cache(name, hashes[name])
+        self.hash_cache.flush()
+        metrics.count('report.figures.rendered', len(done))
+        return done
+
+    def write_summary(self, title, prints, figure_names):
+        """
+        write the numbers and the figures as a markdown and a html page
+        :param title: title of the report
+        :param prints: lines of the analysis, e.g. ChatAnalysis.all_prints
+        :param figure_names: names of the figures to show, in order
+        :return: paths of the markdown and the html file
+        """
+        from Plots import FIGURES
+        lines = [line for line in prints if line.strip()]
+        image_format = 'png' if 'png' in self.formats else self.formats[0]
+        markdown = [f'# {title}', ''] + [f'- {line}' for line in lines] + ['']
+        page = [f'<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>{html.escape(title)}</title></head>',
+                f'<body>\n<h1>{html.escape(title)}</h1>\n<ul>']
+        page += [f'<li>{html.escape(line)}</li>' for line in lines]
+        page.append('</ul>')
+        for name in figure_names:
+            figure_title = FIGURES[name][1]
+            markdown += [f'## {figure_title}', '', f'![{figure_title}]({name}.{image_format})', '']
+            page += [f'<h2>{html.escape(figure_title)}</h2>',
+                     f'<img src="{name}.{image_format}" alt="{html.escape(figure_title)}" style="max-width: 100%">']
+        page.append('</body>\n</html>\n')
+        markdown_file = self.output_path + 'report.md'
+        html_file = self.output_path + 'report.html'
+        with open(markdown_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(markdown))
+        with open(html_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(page))
+        return markdown_file, html_file
+
+    def render(self, title, prints, figure_data):
+        """
+        draw the changed figures and write the summary
+        :param title: title of the report
+        :param prints: lines of the analysis
+        :param figure_data: {figure name: input data}
+        :return: paths of the markdown and the html file
+        """
+        drawn = self.render_figures(figure_data)
+        print(f'Figures drawn: {len(drawn)}, unchanged: {len(figure_data) - len(drawn)}')
+        return self.write_summary(title, prints, list(figure_data))
@@ -0,0 +1,40 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: SeenSet.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 7/29/23 17:02
+"""
+from collections import OrderedDict
+
+
+class SeenSet:
+    """
+    Remember the most recent message ids of a chat to drop duplicates, also when they are not adjacent
+    (e.g. ticker items and messages sent again after a retry). Memory is bounded by max_size ids.
+    """
+    MAX_SIZE = 10000
+
+    def __init__(self, max_size=MAX_SIZE):
+        """
+        :param max_size: max number of ids remembered, the least recently seen id is forgotten first
+        """
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.duplicates = 0
+
+    def is_duplicate(self, message_id):
+        """
+        check if a message was seen before, and remember it
+        :param message_id: id of the message
+        :return: True if the message is a duplicate
+        """
+        if message_id in self.ids:
+            self.ids.move_to_end(message_id)
+            self.duplicates += 1
+            return True
+        self.ids[message_id] = None
+        if len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+        return False
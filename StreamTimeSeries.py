@@ -0,0 +1,236 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: StreamTimeSeries.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 9/2/23 15:18
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from ChatArchive import get_archive, is_archived
+from LocalCache import LocalCache
+from Metrics import metrics
+from PaidChatColumns import get_file_signature, read_paid_chat
+from StreamingChat import iter_json_items
+
+BIN_SECONDS = 60
+
+
+def bin_paid_chat(file_name, bin_seconds=BIN_SECONDS):
+    """
+    sum the paid messages of a video into fixed time windows, runs in the worker processes of StreamTimeSeries.
+    amounts are binned by currency and converted to usd by the caller
+    :param file_name: path of a .npz or .json file
+    :param bin_seconds: width of a window in seconds
+    :return: dict of publish date, duration, number of windows, currencies and amounts [currency][window]
+    """
+    metadata, columns = read_paid_chat(file_name)
+    # messages sent in the waiting room before the stream starts have a negative time
+    times = np.clip(columns['time'], 0, None)
+    duration = metadata.get('duration') or 0
+    end = max(duration, float(times.max()) if len(times) else 0)
+    bin_count = int(end // bin_seconds) + 1
+    edges = np.arange(bin_count + 1, dtype=np.float64) * bin_seconds
+    amounts = np.zeros((len(columns['currencies']), bin_count))
+    for currency in range(len(columns['currencies'])):
+        selected = columns['currency'] == currency
+        amounts[currency], _ = np.histogram(times[selected], bins=edges, weights=columns['amount'][selected])
+    return {'publish_date': metadata['publish_date'],
+            'duration': duration,
+            'bin_count': bin_count,
+            'currencies': columns['currencies'].tolist(),
+            'amounts': amounts.tolist()}
+
+
+def bin_paid_chat_stream(file_name, bin_seconds=BIN_SECONDS):
+    """
+    bin_paid_chat that reads a .json file or an archived video one message at a time, only the sums of the windows
+    that have income are kept. .npz files are binned by bin_paid_chat as they only hold the columns of one video
+    :param file_name: path of a .npz or .json file, or <chat path><video id>.jsonl of a video in the archive
+    :param bin_seconds: width of a window in seconds
+    :return: the same dict as bin_paid_chat
+    """
+    if file_name.endswith('.npz'):
+        return bin_paid_chat(file_name, bin_seconds)
+    if is_archived(file_name):
+        archive, vid = get_archive(file_name)
+        lines = archive.iter_lines(vid)
+        # the first line is the metadata, then one message per line
+        items = itertools.chain([('metadata', next(lines))], ((None, msg_data) for msg_data in lines))
+    else:
+        items = iter_json_items(file_name)
+    metadata = None
+    currencies = {}  # currency -> index, in the order they are first seen
+    windows = {}  # (currency index, window) -> amount
+    last_time = 0
+    with metrics.timer('chat.read.stream'):
+        for key, value in items:
+            if key == 'metadata':
+                metadata = value
+                continue
+            currency = currencies.setdefault(value['money']['currency'], len(currencies))
+            # messages sent in the waiting room before the stream starts have a negative time
+            msg_time = max(value['time'], 0)
+            last_time = max(last_time, msg_time)
+            window = (currency, int(msg_time // bin_seconds))
+            windows[window] = windows.get(window, 0.0) + value['money']['amount']
+    duration = metadata.get('duration') or 0
+    bin_count = int(max(duration, last_time) // bin_seconds) + 1
+    amounts = np.zeros((len(currencies), bin_count))
+    for (currency, window), amount in windows.items():
+        amounts[currency, window] += amount
+    return {'publish_date': metadata['publish_date'],
+            'duration': duration,
+            'bin_count': bin_count,
+            'currencies': list(currencies),
+            'amounts': amounts.tolist()}
+
+
+def bin_video(file_name, bin_seconds, streaming):
+    """
+    bin the paid messages of a video, runs in the worker processes of StreamTimeSeries
+    :param file_name: path of the chat file
+    :param bin_seconds: width of a window in seconds
+    :param streaming: read the file one message at a time, see bin_paid_chat_stream
+    :return: dict returned by bin_paid_chat, with the metrics recorded in a worker process, see Metrics.merge
+    """
+    with metrics.worker_task() as worker_metrics:
+        if streaming:
+            video_bins = bin_paid_chat_stream(file_name, bin_seconds)
+        else:
+            video_bins = bin_paid_chat(file_name, bin_seconds)
+    video_bins['metrics'] = worker_metrics.data
+    return video_bins
+
+
+class StreamTimeSeries:
+    """
+    Paid message income of every stream in fixed time windows, cached per video with the signature of its chat file:
+    {"signature", "publish_date", "duration", "bin_seconds", "usd": [income of every window]}.
+    Only new or changed chat files are parsed, comparisons across streams are computed from the cache.
+    """
+    CACHE_FILE = 'cached_time_series.json'
+
+    def __init__(self, chat_path, video_list, currency_converter, cache_file=CACHE_FILE, bin_seconds=BIN_SECONDS,
+                 workers=1, streaming=False):
+        """
+        :param chat_path: path to the chat folder
+        :param video_list: file names of the videos
+        :param currency_converter: CurrencyConverter used for the windows of new videos
+        :param cache_file: cache file of the binned income
+        :param bin_seconds: width of a window in seconds
+        :param workers: number of processes that parse the chat files, 1 means parse in this process
+        :param streaming: read the .json chat files one message at a time, see StreamingChat
+        """
+        self.chat_path = chat_path
+        self.video_list = video_list
+        self.currency_converter = currency_converter
+        self.cache = LocalCache(cache_file)
+        self.bin_seconds = bin_seconds
+        self.workers = workers
+        self.streaming = streaming
+        self.update()
+
+    def update(self):
+        """
+        bin the videos whose chat file is new or changed, or that were binned with another window width
+        """
+        file_names = [self.chat_path + video for video in self.video_list]
+        signatures = [get_file_signature(file_name) for file_name in file_names]
+        todo = [i for i, video in enumerate(self.video_list)
+                if not (self.cache.is_in_cache(video) and
+                        self.cache.get_local_cache(video)['signature'] == signatures[i] and
+                        self.cache.get_local_cache(video)['bin_seconds'] == self.bin_seconds)]
+        metrics.count('time_series.videos.binned', len(todo))
+        with metrics.stage('time_series.update'):
+            if self.workers > 1 and len(todo) > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    binned = list(executor.map(bin_video, [file_names[i] for i in todo],
+                                               [self.bin_seconds] * len(todo), [self.streaming] * len(todo),
+                                               chunksize=8))
+            else:
+                binned = [bin_video(file_names[i], self.bin_seconds, self.streaming) for i in todo]
+        for i, video_bins in zip(todo, binned):
+            metrics.merge(video_bins['metrics'])
+            day = video_bins['publish_date']
+            factors = np.array([self.currency_converter.get_factor(currency, day)
+                                for currency in video_bins['currencies']])
+            amounts = np.array(video_bins['amounts']).reshape(len(factors), video_bins['bin_count'])
+            self.cache.set_local_cache(self.video_list[i], {'signature': signatures[i],
+                                                            'publish_date': day,
+                                                            'duration': video_bins['duration'],
+                                                            'bin_seconds': self.bin_seconds,
+                                                            'usd': (factors @ amounts).tolist()})
+        self.cache.flush()
+
+    def get_income(self, video):
+        """
+        :param video: file name of the video
+        :return: numpy array of the income in usd of every window
+        """
+        return np.array(self.cache.get_local_cache(video)['usd'])
+
+    def get_income_per_minute(self, video):
+        """
+        :param video: file name of the video
+        :return: numpy array of the income in usd per minute of every window
+        """
+        return self.get_income(video) * (60 / self.bin_seconds)
+
+    def get_cumulative_income(self, video):
+        """
+        :param video: file name of the video
+        :return: numpy array of the income in usd until the end of every window
+        """
+        return np.cumsum(self.get_income(video))
+
+    def get_peak_windows(self, video, window_seconds=300, top=3):
+        """
+        find the windows of a stream that earned the most, the windows do not overlap
+        :param video: file name of the video
+        :param window_seconds: length of a window in seconds, rounded to whole bins
+        :param top: number of windows
+        :return: list of (start in seconds, income in usd), highest first
+        """
+        income = self.get_income(video)
+        window_bins = min(len(income), max(1, round(window_seconds / self.bin_seconds)))
+        cumulative = np.concatenate(([0.0], np.cumsum(income)))
+        window_sums = cumulative[window_bins:] - cumulative[:-window_bins]
+        peaks = []
+        for start in np.argsort(window_sums, kind='stable')[::-1]:
+            if window_sums[start] <= 0 or len(peaks) == top:
+                break
+            if all(abs(start - peak) >= window_bins for peak, _ in peaks):
+                peaks.append((int(start), float(window_sums[start])))
+        return [(start * self.bin_seconds, income_sum) for start, income_sum in peaks]
+
+    def get_stacked_matrix(self, normalize=False, points=100):
+        """
+        stack the income curves of all videos into one matrix to compare streams
+        :param normalize: put every stream on a 0..1 time axis of its duration and divide by its total income,
+            otherwise the rows are the income of every window padded with 0 to the longest stream
+        :param points: number of columns of the normalized matrix
+        :return: list of video file names, numpy array with one row per video
+        """
+        if not normalize:
+            rows = [self.get_income(video) for video in self.video_list]
+            matrix = np.zeros((len(rows), max((len(row) for row in rows), default=0)))
+            for i, row in enumerate(rows):
+                matrix[i, :len(row)] = row
+            return list(self.video_list), matrix
+        grid = np.linspace(0, 1, points)
+        matrix = np.zeros((len(self.video_list), points))
+        for i, video in enumerate(self.video_list):
+            entry = self.cache.get_local_cache(video)
+            cumulative = np.concatenate(([0.0], np.cumsum(entry['usd'])))
+            total = cumulative[-1]
+            if total <= 0:
+                continue
+            # share of the income earned until every fraction of the stream, the chat after the end counts at 1
+            duration = entry['duration'] or len(entry['usd']) * self.bin_seconds
+            window_ends = np.arange(len(cumulative)) * self.bin_seconds / duration
+            matrix[i] = np.interp(grid, window_ends, cumulative / total)
+        return list(self.video_list), matrix
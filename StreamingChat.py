@@ -0,0 +1,171 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: StreamingChat.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 8/19/23 10:52
+"""
+import bisect
+import json
+
+from ChatArchive import get_archive, is_archived
+from MembershipDistribution import TIER_BUCKETS
+from Metrics import metrics
+from WordFrequency import WordFrequency
+
+CHUNK_SIZE = 1 << 16
+# max number of distinct words kept per video, the rarest words are dropped above it
+MAX_WORDS = 20000
+
+decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+
+
+def iter_json_items(file_name, chunk_size=CHUNK_SIZE):
+    """
+    read the items of a json object one at a time, only one chunk of the file and one value are in memory
+    :param file_name: path of a json file whose top level value is an object
+    :param chunk_size: number of characters read at once
+    :return: generator of (key, value)
+    """
+    with open(file_name, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def read_more():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def next_token():
+            """skip whitespace, return the next character or '' at the end of the file"""
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return buffer[pos] if pos < len(buffer) else ''
+                read_more()
+
+        def decode():
+            """decode the json value at pos, read more of the file until it is complete"""
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    read_more()
+                    continue
+                # a number at the end of the buffer may continue in the next chunk
+                if end == len(buffer) and not eof:
+                    read_more()
+                    continue
+                pos = end
+                return value
+
+        if next_token() != '{':
+            raise ValueError(f'{file_name} is not a json object')
+        pos += 1
+        while True:
+            token = next_token()
+            if token == ',':
+                pos += 1
+                token = next_token()
+            if token == '}':
+                return
+            if token != '"':
+                raise ValueError(f'unexpected {token!r} in {file_name}')
+            key = decode()
+            if next_token() != ':':
+                raise ValueError(f'missing : after {key!r} in {file_name}')
+            pos += 1
+            next_token()
+            yield key, decode()
+
+
+class PaidChatAccumulator:
+    """
+    Fold the paid messages of a video one at a time into the sums of summarize_paid_chat,
+    memory does not grow with the number of messages
+    """
+
+    def __init__(self, count_words=True, max_words=MAX_WORDS):
+        """
+        :param count_words: count the words of the messages
+        :param max_words: max number of distinct words kept
+        """
+        self.currencies = {}  # currency -> index, in the order they are first seen
+        self.amounts = []  # sum of amounts by currency index
+        self.cells = {}  # (currency index, membership bucket) -> [messages, amount]
+        self.words = WordFrequency(max_words=max_words) if count_words else None
+        self.metadata = None
+
+    def add(self, msg_data):
+        """
+        add a paid message in the json export format
+        :param msg_data: {"time", "money", "msg", "membership"}
+        """
+        currency = self.currencies.setdefault(msg_data['money']['currency'], len(self.currencies))
+        if currency == len(self.amounts):
+            self.amounts.append(0.0)
+        self.amounts[currency] += msg_data['money']['amount']
+        # older exports have null for badges without a parsable period, counted as non-members
+        bucket = bisect.bisect_right(TIER_BUCKETS, msg_data['membership'] or 0)
+        cell = self.cells.get((currency, bucket))
+        if cell is None:
+            cell = self.cells[(currency, bucket)] = [0, 0.0]
+        cell[0] += 1
+        cell[1] += msg_data['money']['amount']
+        if self.words is not None:
+            self.words.add_message(msg_data['msg'])
+
+    def get_summary(self):
+        """
+        :return: the same dict as PaidChatColumns.summarize_paid_chat
+        """
+        return {'publish_date': self.metadata['publish_date'],
+                'month': self.metadata['publish_date'][:7].replace('-', ''),
+                'currencies': list(self.currencies),
+                'amounts': self.amounts,
+                'duration': self.metadata.get('duration'),
+                'cells': [[currency, bucket, messages, amount]
+                          for (currency, bucket), (messages, amount) in sorted(self.cells.items())],
+                'words': dict(self.words.get_counts()) if self.words is not None else None}
+
+
+def summarize_paid_chat_stream(file_name, count_words=True, max_words=MAX_WORDS):
+    """
+    summarize_paid_chat that reads a .json file one message at a time, for archives too big for memory.
+    .npz files are summarized by PaidChatColumns as they only hold the columns of one video,
+    an archived video is decompressed one line at a time
+    :param file_name: path of a .npz or .json file, or <chat path><video id>.jsonl of a video in the archive
+    :param count_words: count the words of the messages
+    :param max_words: max number of distinct words kept
+    :return: dict of the pre-aggregated paid messages, see PaidChatColumns.summarize_paid_chat
+    """
+    if file_name.endswith('.npz'):
+        from PaidChatColumns import summarize_paid_chat
+        return summarize_paid_chat(file_name, count_words)
+    accumulator = PaidChatAccumulator(count_words, max_words)
+    if is_archived(file_name):
+        archive, vid = get_archive(file_name)
+        with metrics.timer('chat.read.archive'):
+            lines = archive.iter_lines(vid)
+            accumulator.metadata = next(lines)
+            for msg_data in lines:
+                accumulator.add(msg_data)
+        return accumulator.get_summary()
+    with metrics.timer('chat.read.stream'):
+        for key, value in iter_json_items(file_name):
+            if key == 'metadata':
+                accumulator.metadata = value
+            else:
+                accumulator.add(value)
+    return accumulator.get_summary()
@@ -0,0 +1,243 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: TalentRegistry.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 6/17/23 15:40
+"""
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from LocalCache import LocalCache
+
+
+class Talent:
+    """
+    Where the files of one talent are stored
+    """
+
+    def __init__(self, name, path, video_list, metadata_file, chat_path, member_list, stats_path, checkpoint_cache,
+                 word_cache, income_cube, time_series, metadata_cache):
+        """
+        :param name: name of the talent, e.g. voxakuma
+        :param path: folder of the talent
+        :param video_list: text file of video ids, one per line
+        :param metadata_file: json file where the metadata of all videos is exported
+        :param chat_path: folder of the paid message files
+        :param member_list: json file of the member master list
+        :param stats_path: folder of the text stats files
+        :param checkpoint_cache: cache file of the download checkpoints
+        :param word_cache: index of the word counts of every video, see WordFrequency.WordCountCache
+        :param income_cube: cache file of the income cube, see IncomeCube
+        :param time_series: cache file of the income of every stream in time windows, see StreamTimeSeries
+        :param metadata_cache: cache file of the video metadata, shared by all the talents of a registry
+        """
+        self.name = name
+        self.path = path
+        self.video_list = video_list
+        self.metadata_file = metadata_file
+        self.chat_path = chat_path
+        self.member_list = member_list
+        self.stats_path = stats_path
+        self.checkpoint_cache = checkpoint_cache
+        self.word_cache = word_cache
+        self.income_cube = income_cube
+        self.time_series = time_series
+        self.metadata_cache = metadata_cache
+
+    @classmethod
+    def sharded(cls, name, root='talents/'):
+        """
+        layout with all the files of a talent in its own folder root/<name>/
+        :param name: name of the talent
+        :param root: folder of all talents
+        :return: Talent
+        """
+        path = f'{root}{name}/'
+        return cls(name, path,
+                   video_list=f'{path}all_videos.txt',
+                   metadata_file=f'{path}all_metadata.txt',
+                   chat_path=f'{path}chats/',
+                   member_list=f'{path}membership/member_list.json',
+                   stats_path=f'{path}stats/',
+                   checkpoint_cache=f'{path}checkpoint.json',
+                   word_cache=f'{path}cached_word_freq.json',
+                   income_cube=f'{path}cached_income_cube.json',
+                   time_series=f'{path}cached_time_series.json',
+                   metadata_cache=f'{root}{TalentRegistry.METADATA_CACHE}')
+
+    @classmethod
+    def legacy(cls, name):
+        """
+        the original layout of a single talent, files in the working folder
+        :param name: name of the talent
+        :return: Talent
+        """
+        return cls(name, '',
+                   video_list=f'all_videos_{name}.txt',
+                   metadata_file=f'all_metadata_{name}.txt',
+                   chat_path='chats/',
+                   member_list='membership/member_list.json',
+                   stats_path='stats/',
+                   checkpoint_cache=f'checkpoint_{name}.json',
+                   word_cache='cached_word_freq.json',
+                   income_cube='cached_income_cube.json',
+                   time_series='cached_time_series.json',
+                   metadata_cache=f'metadata_cache_{name}.json')
+
+    def make_dirs(self):
+        """
+        create the folders of the talent
+        """
+        for folder in (self.chat_path, os.path.dirname(self.member_list), self.stats_path):
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+
+class TalentRegistry:
+    """
+    All the tracked talents, saved in talents.json as {name: {info}}.
+    Talents share the metadata cache and the exchange rates, everything else is stored per talent.
+    """
+    REGISTRY_FILE = 'talents.json'
+    ROOT = 'talents/'
+    METADATA_CACHE = 'metadata_cache.json'
+
+    def __init__(self, registry_file=REGISTRY_FILE, root=ROOT):
+        """
+        :param registry_file: json file of the registry
+        :param root: folder of all talents
+        """
+        self.registry_file = registry_file
+        self.root = root
+        try:
+            with open(registry_file, 'r') as f:
+                self.talents = json.load(f)
+        except FileNotFoundError:
+            self.talents = {}
+        self.metadata_cache = None
+
+    def save(self):
+        """
+        write the registry to the registry file
+        """
+        with open(self.registry_file, 'w') as f:
+            f.write(json.dumps(self.talents, indent=2))
+
+    def add_talent(self, name, **info):
+        """
+        add a talent to the registry and create its folders
+        :param name: name of the talent
+        :param info: anything to remember about the talent, e.g. display_name
+        :return: Talent
+        """
+        self.talents[name] = info
+        self.save()
+        talent = self.get_talent(name)
+        talent.make_dirs()
+        return talent
+
+    def get_names(self):
+        """
+        :return: names of all talents
+        """
+        return list(self.talents)
+
+    def get_talent(self, name):
+        """
+        :param name: name of the talent
+        :return: Talent
+        """
+        if name not in self.talents:
+            raise KeyError(f'talent {name} is not in {self.registry_file}')
+        return Talent.sharded(name, self.root)
+
+    def get_metadata_cache(self):
+        """
+        the metadata cache shared by all talents, videos are keyed by url so they never collide
+        :return: LocalCache
+        """
+        if self.metadata_cache is None:
+            self.metadata_cache = LocalCache(self.root + self.METADATA_CACHE)
+        return self.metadata_cache
+
+    def import_legacy_files(self, name):
+        """
+        copy the files of the original single talent layout into the folder of the talent
+        :param name: name of the talent
+        :return: Talent
+        """
+        if name not in self.talents:
+            self.add_talent(name)
+        legacy = Talent.legacy(name)
+        talent = self.get_talent(name)
+        talent.make_dirs()
+        for src, dst in ((legacy.video_list, talent.video_list),
+                         (legacy.metadata_file, talent.metadata_file),
+                         (legacy.member_list, talent.member_list)):
+            if os.path.exists(src):
+                shutil.copyfile(src, dst)
+        if os.path.isdir(legacy.chat_path):
+            shutil.copytree(legacy.chat_path, talent.chat_path, dirs_exist_ok=True)
+        # the old metadata cache was per talent, merge it into the shared one
+        if os.path.exists(legacy.metadata_cache):
+            metadata_cache = self.get_metadata_cache()
+            for url, metadata in LocalCache(legacy.metadata_cache).cached_data.items():
+                metadata_cache.set_local_cache(url, metadata)
+            metadata_cache.flush()
+        return talent
+
+    def download_all(self, names=None, workers=1, talent_workers=1):
+        """
+        download the chat of all videos of many talents in one process
+        :param names: names of the talents, all talents if None
+        :param workers: max number of videos of a talent downloaded at the same time
+        :param talent_workers: max number of talents downloaded at the same time
+        """
+        from ChatDownload import ChatDownload
+        names = self.get_names() if names is None else names
+        metadata_cache = self.get_metadata_cache()
+
+        def download(name):
+            down = ChatDownload(talent=self.get_talent(name), metadata_cache=metadata_cache)
+            down.get_all_chat(workers)
+
+        with ThreadPoolExecutor(max_workers=max(1, talent_workers)) as executor:
+            for name, future in zip(names, [executor.submit(download, name) for name in names]):
+                future.result()
+                print(f'Talent {name} done')
+        metadata_cache.flush()
+
+    def compare_talents(self, names=None, rate_source=None, workers=1):
+        """
+        analysis many talents and print a table that compares them
+        :param names: names of the talents, all talents if None
+        :param rate_source: source of exchange rates, see RateTable
+        :param workers: number of processes that parse the chat files of a talent
+        :return: list of dict, one row per talent
+        """
+        from ChatAnalysis import ChatAnalysis
+        from CurrencyExchange import CurrencyExchange
+        names = self.get_names() if names is None else names
+        currency_exchange = CurrencyExchange(rate_source)
+        rows = []
+        for name in names:
+            ca = ChatAnalysis(talent=self.get_talent(name), currency_exchange=currency_exchange, workers=workers)
+            membership_revenue = ca.membership.get_revenue(ca.MEMBERSHIP_PRICE)
+            rows.append({'talent': name,
+                         'videos': len(ca.video_list),
+                         'paid_message_revenue': round(ca.total_income_in_usd, 2),
+                         'members': ca.membership.get_member_count(),
+                         'average_membership_length': round(ca.membership.get_average_length(), 2),
+                         'membership_revenue': round(membership_revenue, 2),
+                         'total_revenue': round(ca.total_income_in_usd + membership_revenue, 2)})
+        rows.sort(key=lambda row: row['total_revenue'], reverse=True)
+        header = ['talent', 'videos', 'paid_message_revenue', 'members', 'average_membership_length',
+                  'membership_revenue', 'total_revenue']
+        print(' | '.join(header))
+        for row in rows:
+            print(' | '.join(str(row[column]) for column in header))
+        return rows
@@ -0,0 +1,125 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: WordFrequency.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 6/3/23 10:52
+"""
+import json
+import os
+import re
+from collections import Counter
+
+from LocalCache import LocalCache
+
+TOKEN_PATTERN = re.compile(r"\w[\w']+")
+
+
+def get_stopwords():
+    """
+    get the default stopwords of WordCloud
+    :return: set of stopwords
+    """
+    from wordcloud import STOPWORDS
+    return STOPWORDS
+
+
+class WordFrequency:
+    """
+    Count words of messages one message at a time, the counts can be merged and fed to WordCloud.
+    With max_words the number of distinct words is bounded, the rarest words are dropped when it is exceeded
+    """
+
+    def __init__(self, stopwords=None, max_words=None):
+        """
+        :param stopwords: set of lower case words to ignore, WordCloud's stopwords if None
+        :param max_words: max number of distinct words kept, no limit if None
+        """
+        self.stopwords = stopwords if stopwords is not None else get_stopwords()
+        self.max_words = max_words
+        self.counts = Counter()
+
+    def add_message(self, message):
+        """
+        count the words of a message
+        :param message: text of the message
+        """
+        if not message:
+            return
+        for token in TOKEN_PATTERN.findall(message.lower()):
+            if token.endswith("'s"):
+                token = token[:-2]
+            if len(token) > 1 and token not in self.stopwords and not token.isdigit():
+                self.counts[token] += 1
+        self.limit_words()
+
+    def merge(self, counts):
+        """
+        add the counts of another video
+        :param counts: dict of word: count
+        """
+        self.counts.update(counts)
+        self.limit_words()
+
+    def limit_words(self):
+        """
+        keep the most common max_words words once there are twice as many, so pruning is rare
+        """
+        if self.max_words is not None and len(self.counts) > 2 * self.max_words:
+            self.counts = Counter(dict(self.counts.most_common(self.max_words)))
+
+    def get_counts(self):
+        """
+        :return: Counter of at most max_words words
+        """
+        if self.max_words is not None and len(self.counts) > self.max_words:
+            self.counts = Counter(dict(self.counts.most_common(self.max_words)))
+        return self.counts
+
+
+class WordCountCache:
+    """
+    Word counts of every video, one file per video in a folder next to the index so only one video is in memory
+    at a time, the index {video: signature of its chat file} is a LocalCache
+    """
+
+    def __init__(self, cache_file):
+        """
+        :param cache_file: index file, the counts are in the folder of the same name without the extension
+        """
+        self.index = LocalCache(cache_file)
+        self.path = os.path.splitext(cache_file)[0] + '/'
+        os.makedirs(self.path, exist_ok=True)
+
+    def is_up_to_date(self, video, signature):
+        """
+        :param video: file name of the video
+        :param signature: signature of the chat file, see PaidChatColumns.get_file_signature
+        :return: True if the counts of the video are cached for this version of the file
+        """
+        return self.index.is_in_cache(video) and self.index.get_local_cache(video) == signature
+
+    def get_counts(self, video):
+        """
+        :param video: file name of the video
+        :return: dict of word: count
+        """
+        with open(f'{self.path}{video}.json', 'r') as f:
+            return json.load(f)
+
+    def set_counts(self, video, signature, counts):
+        """
+        :param video: file name of the video
+        :param signature: signature of the chat file
+        :param counts: dict of word: count
+        """
+        file_name = f'{self.path}{video}.json'
+        with open(file_name + '.tmp', 'w') as f:
+            f.write(json.dumps(counts))
+        os.replace(file_name + '.tmp', file_name)
+        # the index is updated after the file, an interrupted write only makes the video counted again
+        self.index.set_local_cache(video, signature)
+
+    def flush(self):
+        self.index.flush()
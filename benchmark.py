@@ -0,0 +1,368 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: benchmark.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 7/15/23 14:30
+"""
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use('Agg')  # no window while benchmarking
+
+CURRENCIES = [('USD', '$', 1.0), ('JPY', '¥', 140.0), ('EUR', '€', 0.9), ('GBP', '£', 0.8), ('VND', '₫', 23500.0)]
+BADGE_TITLES = ['New member', 'Member (1 month)', 'Member (2 months)', 'Member (6 months)', 'Member (1 year)',
+                'Member (2 years)']
+WORDS = ['hello', 'vox', 'love', 'stream', 'happy', 'birthday', 'thank', 'you', 'akuma', 'demon', 'lord', 'gg']
+
+
+def generate_chat(message_count, seed=0, author_count=2000, duplicate_rate=0.02):
+    """
+    generate messages shaped like the ones of ChatDownloader
+    :param message_count: number of unique messages
+    :param seed: random seed, the same seed gives the same messages
+    :param author_count: number of different authors
+    :param duplicate_rate: chance that a message is sent again right after itself
+    :return: list of message dicts
+    """
+    rng = random.Random(seed)
+    messages = []
+    for i in range(message_count):
+        author_id = f'UC{rng.randrange(author_count):022d}'
+        author = {'name': f'user {author_id[-4:]}', 'id': author_id}
+        if rng.random() < 0.3:
+            author['badges'] = [{'title': rng.choice(BADGE_TITLES)}]
+        message = {'message_id': f'msg{seed}-{i}',
+                   'time_in_seconds': i * 0.5,
+                   'author': author,
+                   'message': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))}
+        kind = rng.random()
+        if kind < 0.03:
+            message['message_type'] = 'paid_message'
+        elif kind < 0.04:
+            message['message_type'] = 'paid_sticker'
+            message['message'] = None
+        elif kind < 0.05:
+            message['message_type'] = 'membership_item'
+            author['badges'] = [{'title': rng.choice(BADGE_TITLES)}]
+        else:
+            message['message_type'] = 'text_message'
+        if message['message_type'] in ('paid_message', 'paid_sticker'):
+            code, symbol, rate = rng.choice(CURRENCIES)
+            amount = round(rng.choice([2, 5, 10, 20, 50, 100]) * rate, 2)
+            message['money'] = {'amount': amount, 'currency': code, 'currency_symbol': symbol,
+                                'text': f'{symbol}{amount}'}
+        messages.append(message)
+        if rng.random() < duplicate_rate:
+            messages.append(dict(message))
+    return messages
+
+
+def write_rates(file_name, start_year=2021, end_year=2023):
+    """
+    write a rate file for StaticRateSource so the analysis runs offline
+    :param file_name: path of the rate file
+    """
+    rates = {}
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            for day in range(1, 32):
+                rates[f'{year}-{month:02d}-{day:02d}'] = {code: rate for code, symbol, rate in CURRENCIES}
+    with open(file_name, 'w') as f:
+        json.dump(rates, f)
+
+
+def measure(name, items, function, setup=None):
+    """
+    run a function twice, once for the time and once for the peak memory, tracemalloc slows down allocations
+    too much to time the same run
+    :param name: name of the benchmark
+    :param items: number of items processed, used for throughput
+    :param function: function without arguments
+    :param setup: function without arguments called before each run so both runs do the same work, optional
+    :return: dict of results
+    """
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {'name': name, 'items': items, 'seconds': round(seconds, 4),
+              'items_per_second': round(items / seconds, 1) if seconds else None,
+              'peak_memory_mb': round(peak / 2 ** 20, 2)}
+    print(f"{name:<40} {items:>9} items {seconds:>9.3f} s {result['items_per_second']:>12} /s "
+          f"{result['peak_memory_mb']:>9} MB")
+    return result
+
+
+def remove_files(*file_names):
+    """
+    remove files left by an earlier run of a benchmark
+    :param file_names: paths of the files, missing files are ignored
+    """
+    for file_name in file_names:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+
+def bench_download(messages, video_count):
+    """
+    time the paid message and membership consumers on synthetic chats
+    :param messages: messages per video
+    :param video_count: number of videos
+    :return: list of results
+    """
+    from ChatDownload import ChatDownload
+    from TalentRegistry import Talent
+    vids = [f'bench{i:06d}' for i in range(video_count)]
+    with open('all_videos_bench.txt', 'w') as f:
+        f.write('\n'.join(vids) + '\n')
+    chats = [generate_chat(messages, seed=i) for i in range(video_count)]
+    results = []
+    for consumer in ('paid', 'membership'):
+        down = ChatDownload(consumers=(consumer,), talent=Talent.legacy('bench'))
+        for i, vid in enumerate(vids):
+            down.metadata_cache.set_local_cache(down.BASE_URL + vid, {'title': vid, 'views': 0, 'duration': 3600,
+                                                                      'publish_date': f'2022-{i % 12 + 1:02d}-15'})
+        down.metadata_cache.flush()
+
+        def run():
+            for vid, chat in zip(vids, chats):
+                url = down.BASE_URL + vid
+                down.record_chat(url, iter(chat), down.get_consumers(url))
+            down.member_index.flush()
+
+        results.append(measure(f'record {consumer} chat', sum(len(chat) for chat in chats), run))
+    return results
+
+
+def bench_replay(messages, video_count, latency=0.0):
+    """
+    time the whole download pipeline, get_all_chat with every consumer, on chats replayed from recordings
+    :param messages: messages per video
+    :param video_count: number of videos
+    :param latency: seconds of simulated latency per replayed request
+    :return: list of results
+    """
+    from ChatDownload import ChatDownload
+    from Replay import ReplayChatSource, ReplayStore
+    from TalentRegistry import Talent
+    store = ReplayStore('bench_replay/', mode='replay', latency=latency)
+    # video ids are 11 characters like the ones of YouTube, the id is taken from the end of the url
+    vids = [f'rplay{i:06d}' for i in range(video_count)]
+    with open('all_videos_replay.txt', 'w') as f:
+        f.write('\n'.join(vids) + '\n')
+    chats = [generate_chat(messages, seed=100 + i) for i in range(video_count)]
+    for vid, chat in zip(vids, chats):
+        header = {'url': ChatDownload.BASE_URL + vid, 'message_types': None}
+        for _ in store.write_lines('chat', ChatDownload.BASE_URL + vid, [header] + chat):
+            pass
+    talent = Talent.legacy('replay')
+    down = ChatDownload(talent=talent, chat_source=ReplayChatSource(store))
+    for i, vid in enumerate(vids):
+        down.metadata_cache.set_local_cache(down.BASE_URL + vid, {'title': vid, 'views': 0, 'duration': 3600,
+                                                                  'publish_date': f'2022-{i % 12 + 1:02d}-15'})
+    down.metadata_cache.flush()
+    downloads = {}
+
+    def setup():
+        # forget the checkpoints of the previous run, otherwise every video is already done
+        remove_files(talent.checkpoint_cache, talent.checkpoint_cache + '.log')
+        downloads['down'] = ChatDownload(talent=talent, chat_source=ReplayChatSource(store))
+
+    name = f'replay get_all_chat latency {latency}' if latency else 'replay get_all_chat'
+    return [measure(name, sum(len(chat) for chat in chats), lambda: downloads['down'].get_all_chat(), setup)]
+
+
+class SimulatedCrash(Exception):
+    """
+    raised by CrashingChatSource to stop a download in the middle of a chat
+    """
+
+
+class CrashingChatSource:
+    """
+    chat source of generated chats, stops with SimulatedCrash after a number of messages of one video
+    """
+
+    def __init__(self, chats, crash_url=None, crash_after=0):
+        """
+        :param chats: {url: list of message dicts}
+        :param crash_url: url of the video to stop in, never stops if None
+        :param crash_after: number of messages of the video sent before it stops
+        """
+        self.chats = chats
+        self.crash_url = crash_url
+        self.crash_after = crash_after
+
+    def get_chat(self, url, start_time=None, message_types=None):
+        for i, message in enumerate(self.chats[url]):
+            if url == self.crash_url and i == self.crash_after:
+                raise SimulatedCrash(f'simulated crash in {url} after {i} messages')
+            if start_time is None or message['time_in_seconds'] >= start_time:
+                yield message
+
+
+def check_resume(messages, video_count):
+    """
+    check that a download stopped in the middle of a chat and resumed from its checkpoint writes the same files
+    as a download that was never stopped
+    :param messages: messages per video
+    :param video_count: number of videos
+    """
+    from ChatDownload import ChatDownload
+    from TalentRegistry import Talent
+    vids = [f'resum{i:06d}' for i in range(video_count)]
+    chats = {ChatDownload.BASE_URL + vid: generate_chat(messages, seed=200 + i) for i, vid in enumerate(vids)}
+    # the crash is in the last video, after some checkpoints of it were taken
+    crash_url = ChatDownload.BASE_URL + vids[-1]
+    talents = {}
+    for name in ('resume_clean', 'resume_crash'):
+        talent = Talent.sharded(name, 'resume/')
+        talent.make_dirs()
+        with open(talent.video_list, 'w') as f:
+            f.write('\n'.join(vids) + '\n')
+        talents[name] = talent
+    down = ChatDownload(talent=talents['resume_clean'], chat_source=CrashingChatSource(chats))
+    for i, url in enumerate(chats):
+        down.metadata_cache.set_local_cache(url, {'title': url[-11:], 'views': 0, 'duration': messages,
+                                                  'publish_date': f'2022-{i % 12 + 1:02d}-15'})
+    down.metadata_cache.flush()
+    down.get_all_chat()
+
+    checkpoint_every = max(1, messages // 4)
+    down = ChatDownload(talent=talents['resume_crash'],
+                        chat_source=CrashingChatSource(chats, crash_url, messages * 2 // 3))
+    down.CHECKPOINT_EVERY = checkpoint_every
+    try:
+        down.get_all_chat()
+        raise AssertionError('the download was not stopped')
+    except SimulatedCrash as e:
+        print(e)
+    # like a killed process, the members of the videos finished before the crash were never written
+    atexit.unregister(down.member_index.flush)
+    down = ChatDownload(talent=talents['resume_crash'], chat_source=CrashingChatSource(chats))
+    down.CHECKPOINT_EVERY = checkpoint_every
+    down.get_all_chat()
+
+    clean, resumed = talents['resume_clean'], talents['resume_crash']
+    pairs = [(clean.member_list, resumed.member_list)]
+    for vid in vids:
+        pairs += [(f'{clean.chat_path}{vid}.json', f'{resumed.chat_path}{vid}.json'),
+                  (f'{clean.stats_path}{vid}.json', f'{resumed.stats_path}{vid}.json')]
+    for clean_file, resumed_file in pairs:
+        with open(clean_file, 'r') as f:
+            clean_data = json.load(f)
+        with open(resumed_file, 'r') as f:
+            resumed_data = json.load(f)
+        if clean_data != resumed_data:
+            raise AssertionError(f'{resumed_file} differs from {clean_file} after the resume')
+    print(f'resume check passed, {len(pairs)} files match')
+
+
+def bench_local_cache(key_counts):
+    """
+    time LocalCache.set_local_cache with a growing number of keys
+    :param key_counts: list of numbers of keys
+    :return: list of results
+    """
+    from LocalCache import LocalCache
+    results = []
+    for key_count in key_counts:
+        caches = {}
+
+        def setup():
+            file_name = f'bench_cache_{key_count}.json'
+            remove_files(file_name, file_name + '.log')
+            caches['cache'] = LocalCache(file_name)
+
+        def run():
+            cache = caches['cache']
+            for i in range(key_count):
+                cache.set_local_cache(f'https://www.youtube.com/watch?v={i:011d}',
+                                      {'title': f'video {i}', 'publish_date': '2022-01-01', 'views': i,
+                                       'duration': 3600})
+            cache.flush()
+
+        results.append(measure(f'LocalCache.set_local_cache {key_count} keys', key_count, run, setup))
+    return results
+
+
+def bench_analysis(video_count):
+    """
+    time loading the paid messages and the membership analysis, uses the files written by bench_download
+    :param video_count: number of videos
+    :return: list of results
+    """
+    from ChatAnalysis import ChatAnalysis
+    from RateTable import StaticRateSource
+    write_rates('bench_rates.json')
+    source = StaticRateSource('bench_rates.json')
+    import matplotlib.pyplot  # loaded by the first plot, keep the import out of the measurements
+    from IncomeCube import IncomeCube
+    results = []
+    analysis = {}
+
+    def clear_caches():
+        # without the income cube and the word counts every chat file is parsed and aggregated again
+        cube_file = IncomeCube.CUBE_FILE
+        remove_files(cube_file, cube_file + '.log', ChatAnalysis.WORD_CACHE, ChatAnalysis.WORD_CACHE + '.log')
+        shutil.rmtree(os.path.splitext(ChatAnalysis.WORD_CACHE)[0], ignore_errors=True)
+
+    def load():
+        analysis['ca'] = ChatAnalysis(rate_source=source)
+
+    results.append(measure('ChatAnalysis.load_paid_message cold', video_count, load, clear_caches))
+    # the caches are filled by the cold run, this measures a repeated analysis run
+    results.append(measure('ChatAnalysis.load_paid_message cached', video_count, load))
+    results.append(measure('ChatAnalysis.analysis_membership', analysis['ca'].membership.get_member_count(),
+                           analysis['ca'].analysis_membership))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline benchmarks of download parsing, cache I/O and analysis')
+    parser.add_argument('--messages', type=int, default=20000, help='messages per video')
+    parser.add_argument('--videos', type=int, default=10, help='number of videos')
+    parser.add_argument('--cache-keys', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='numbers of keys for the LocalCache benchmark')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of simulated network latency per request in the replay benchmark')
+    parser.add_argument('--json', help='write the results to this json file')
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    work_dir = tempfile.mkdtemp(prefix='vtuber_bench_')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        results = bench_download(args.messages, args.videos)
+        results += bench_local_cache(args.cache_keys)
+        results += bench_analysis(args.videos)
+        results += bench_replay(args.messages, args.videos, args.latency)
+        check_resume(args.messages, min(args.videos, 3))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+    if json_path:
+        with open(json_path, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,223 @@
-import chat_downloader.errors
-from chat_downloader import ChatDownloader
-from CurrencyExchange import CurrencyExchange
-
-
-def get_chat():
-    url = 'https://www.youtube.com/watch?v=wPt5vEHEJkA'
-    chat = ChatDownloader().get_chat(url, message_types=['text_message',
-                                                         'membership_item',
-                                                         'paid_message',
-                                                         'paid_sticker',
-                                                         'sponsorships_gift_purchase_announcement',
-                                                         'ticker_paid_sticker_item',
-                                                         'ticker_paid_message_item',
-                                                         'ticker_sponsor_item',
-                                                         'banner',
-                                                         'banner_header',
-                                                         'donation_announcement'])
-    # chat = ChatDownloader().get_chat(url, message_types=['paid_message','paid_sticker','ticker_paid_sticker_item',
-    # 'ticker_paid_message_item',]) for message in chat: chat.print_formatted(message) print(message)
-    last = ''
-    for message in chat:
-        # print(message['message_id'])
-        if message['message_id'] != last:
-            last = message['message_id']
-            if 'id' in message['author'] and 'badges' in message['author']:
-                print(message['author']['id'])
-                print(message['author']['badges'][0]['title'])
-            # print(message['time_in_seconds'], message['money'])  # print the message
-
-
-try:
-    get_chat()
-except chat_downloader.errors.ChatDownloaderError:
-    print("1111222")
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: main.py
+@author: Jerry(Ruihuang)Yang
+@email: rxy216@case.edu
+@time: 8/26/23 13:05
+"""
+import argparse
+
+# heavy dependencies (matplotlib, wordcloud, pytube, chat_downloader, requests) are imported by the commands
+# that need them, so e.g. a totals query starts fast
+
+
+def get_talent(args):
+    """
+    :param args: parsed arguments
+    :return: Talent of --talent from the registry, None for the original single talent layout
+    """
+    if args.talent is None:
+        return None
+    from TalentRegistry import TalentRegistry
+    registry = TalentRegistry()
+    if args.talent not in registry.get_names():
+        args.parser.error(f'talent {args.talent} is not in {registry.registry_file}, add it with talent-add')
+    return registry.get_talent(args.talent)
+
+
+def get_replay_store(args):
+    """
+    :param args: parsed arguments
+    :return: ReplayStore of --replay, None to use the network directly
+    """
+    if args.replay is None:
+        return None
+    from Replay import ReplayStore
+    return ReplayStore(args.replay, args.replay_mode, args.latency)
+
+
+def get_rate_source(args):
+    """
+    :param args: parsed arguments
+    :return: StaticRateSource of --rate-file, exchangerate.host through the replay store of --replay,
+        None for exchangerate.host
+    """
+    if args.rate_file is not None:
+        from RateTable import StaticRateSource
+        return StaticRateSource(args.rate_file)
+    store = get_replay_store(args)
+    if store is None:
+        return None
+    from RateTable import ExchangeRateHostSource
+    from Replay import ReplayHttp
+    return ExchangeRateHostSource(ReplayHttp(store))
+
+
+def get_analysis(args, words=True):
+    """
+    :param args: parsed arguments
+    :param words: count the words for the word cloud
+    :return: ChatAnalysis
+    """
+    from ChatAnalysis import ChatAnalysis
+    return ChatAnalysis(rate_source=get_rate_source(args), workers=args.workers, talent=get_talent(args),
+                        streaming=args.streaming, words=words)
+
+
+def download(args):
+    from ChatDownload import ChatDownload
+    store = get_replay_store(args)
+    chat_source = None
+    if store is not None:
+        from Replay import ReplayChatSource
+        chat_source = ReplayChatSource(store)
+    down = ChatDownload(consumers=tuple(args.consumers), paid_format=args.paid_format, talent=get_talent(args),
+                        chat_source=chat_source)
+    down.get_all_chat(args.workers)
+
+
+def metadata(args):
+    from ChatDownload import ChatDownload
+    store = get_replay_store(args)
+    metadata_provider = None
+    if store is not None:
+        from Replay import ReplayMetadataProvider
+        metadata_provider = ReplayMetadataProvider(store)
+    down = ChatDownload(talent=get_talent(args), metadata_provider=metadata_provider)
+    down.get_metadata(args.workers, args.rate)
+
+
+def analyze(args):
+    if args.totals:
+        ca = get_analysis(args, words=False)
+        for line in ca.summarize_all():
+            if line.strip():
+                print(line)
+        return
+    get_analysis(args).analysis_all()
+
+
+def report(args):
+    get_analysis(args).write_report(args.output, args.formats, args.render_workers)
+
+
+def migrate(args):
+    from ChatArchive import migrate_chat_dir
+    talent = get_talent(args)
+    migrate_chat_dir(talent.chat_path if talent is not None else 'chats/', remove=not args.keep)
+
+
+def talent_add(args):
+    from TalentRegistry import TalentRegistry
+    info = {} if args.display_name is None else {'display_name': args.display_name}
+    talent = TalentRegistry().add_talent(args.name, **info)
+    print(f'Talent {args.name} added, files in {talent.path}')
+
+
+def talent_import(args):
+    from TalentRegistry import TalentRegistry
+    talent = TalentRegistry().import_legacy_files(args.name)
+    print(f'Talent {args.name} imported into {talent.path}')
+
+
+def compare(args):
+    from TalentRegistry import TalentRegistry
+    registry = TalentRegistry()
+    unknown = [name for name in args.names if name not in registry.get_names()]
+    if unknown:
+        args.parser.error(f'talents {", ".join(unknown)} are not in {registry.registry_file}')
+    registry.compare_talents(args.names or None, get_rate_source(args), args.workers)
+
+
+def dump_chat(args):
+    """
+    print the member badges of a live chat, used to debug the badge titles
+    """
+    import chat_downloader.errors
+    from chat_downloader import ChatDownloader
+    from ChatConsumer import ALL_MESSAGE_TYPES
+    from SeenSet import SeenSet
+    try:
+        chat = ChatDownloader().get_chat(args.url, message_types=list(ALL_MESSAGE_TYPES))
+        seen = SeenSet()
+        for message in chat:
+            if not seen.is_duplicate(message['message_id']):
+                if 'id' in message['author'] and 'badges' in message['author']:
+                    print(message['author']['id'])
+                    print(message['author']['badges'][0]['title'])
+    except chat_downloader.errors.ChatDownloaderError as e:
+        print(f'chat download failed: {e}')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='download and analysis the income of Vtubers on Youtube')
+    parser.add_argument('--talent', help='talent in talents.json, the original single talent layout if not set')
+    parser.add_argument('--replay', help='folder of recorded chats, metadata and rates, to run without network')
+    parser.add_argument('--replay-mode', default='auto', choices=['auto', 'record', 'replay'],
+                        help='auto replays what was recorded and records the rest')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of simulated latency per replayed request')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('download', help='download the chat of all videos in the video list')
+    command.add_argument('--workers', type=int, default=1, help='videos downloaded at the same time')
+    command.add_argument('--consumers', nargs='+', default=['paid', 'membership', 'stats'],
+                         choices=['paid', 'membership', 'stats'], help='what to record from the chat')
+    command.add_argument('--paid-format', default='json', choices=['json', 'npz', 'archive'],
+                         help='format of the paid messages')
+    command.set_defaults(func=download)
+
+    command = commands.add_parser('metadata', help='fetch the metadata of all videos in the video list')
+    command.add_argument('--workers', type=int, default=2, help='threads fetching metadata')
+    command.add_argument('--rate', type=float, default=1 / 3, help='max requests per second')
+    command.set_defaults(func=metadata)
+
+    for name, func, help_text in (('analyze', analyze, 'print the numbers and show the plots'),
+                                  ('report', report, 'write the figures and a summary page without a display')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--workers', type=int, default=1, help='processes parsing the chat files')
+        command.add_argument('--streaming', action='store_true', help='bounded memory, for very large archives')
+        command.add_argument('--rate-file', help='json file of exchange rates, to run offline')
+        command.set_defaults(func=func)
+        if name == 'analyze':
+            command.add_argument('--totals', action='store_true', help='only print the totals, no plots or words')
+        else:
+            command.add_argument('--output', default='report/', help='folder of the report')
+            command.add_argument('--formats', nargs='+', default=['png', 'svg'], help='file formats of the figures')
+            command.add_argument('--render-workers', type=int, default=2, help='processes drawing the figures')
+
+    command = commands.add_parser('migrate', help='move the .json and .npz chat files into the compressed archive')
+    command.add_argument('--keep', action='store_true', help='keep the files after they are archived')
+    command.set_defaults(func=migrate)
+
+    command = commands.add_parser('talent-add', help='add a talent to talents.json and create its folders')
+    command.add_argument('name', help='name of the talent, e.g. voxakuma')
+    command.add_argument('--display-name', help='name shown for the talent')
+    command.set_defaults(func=talent_add)
+
+    command = commands.add_parser('talent-import',
+                                  help='copy the files of the original single talent layout into a talent folder')
+    command.add_argument('name', help='name of the talent, added to talents.json if missing')
+    command.set_defaults(func=talent_import)
+
+    command = commands.add_parser('compare', help='print a table that compares the income of the talents')
+    command.add_argument('names', nargs='*', help='names of the talents, all talents if not set')
+    command.add_argument('--workers', type=int, default=1, help='processes parsing the chat files of a talent')
+    command.add_argument('--rate-file', help='json file of exchange rates, to run offline')
+    command.set_defaults(func=compare)
+
+    command = commands.add_parser('dump-chat', help='print the member badges of the chat of a video')
+    command.add_argument('url', help='url of the video')
+    command.set_defaults(func=dump_chat)
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    args.parser = parser  # commands report bad arguments, e.g. an unknown talent, like argparse does
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
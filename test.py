@@ -12,11 +12,12 @@ import time
 total_iterations = 100
 
 
-for i in range(total_iterations):
-    # Do some processing here
+if __name__ == '__main__':
+    for i in range(total_iterations):
+        # Do some processing here
 
-    # Print the progress
-    print('\r', i, '/100', end='')
+        # Print the progress
+        print('\r', i, '/100', end='')
 
-    # Sleep for a short time to simulate processing time
-    time.sleep(1)
\ No newline at end of file
+        # Sleep for a short time to simulate processing time
+        time.sleep(1)